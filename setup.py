@@ -1,6 +1,5 @@
-import sys
 from wieldymarkup import __version__
-from distutils.core import setup
+from setuptools import setup
 
 # To install the wieldymarkup-python library, open a Terminal shell, then run this
 # file by typing:
@@ -9,33 +8,35 @@ from distutils.core import setup
 #
 # You need to have the setuptools module installed. Try reading the setuptools
 # documentation: http://pypi.python.org/pypi/setuptools
+# six is only used by the tests in wieldymarkup.test
 REQUIRES = ["six"]
 
-if sys.version_info >= (3,0):
-  REQUIRES.append('unittest2py3k')
-else:
-  REQUIRES.append('unittest2')
-
 setup(
   name = "wieldymarkup",
   version = __version__,
   packages = ['wieldymarkup', 'wieldymarkup.test'],
+  package_data = {'wieldymarkup': ['benchmark-baseline.json']},
   description = "WieldyMarkup HTML Abstraction Markup Language Compiler",
   author = "Vail Gold",
   author_email = "vail@vailgold.com",
   url = "http://github.com/vail130/wieldymarkup-python/",
   license = "LICENSE.txt",
+  python_requires = ">=3.7",
   install_requires = REQUIRES,
+  extras_require = {'brotli': ["brotli"]},
   classifiers = [
     "Development Status :: 4 - Beta",
     "Intended Audience :: Developers",
     "License :: OSI Approved :: MIT License",
     "Operating System :: OS Independent",
     "Programming Language :: Python",
-    "Programming Language :: Python :: 2.5",
-    "Programming Language :: Python :: 2.6",
-    "Programming Language :: Python :: 2.7",
-    "Programming Language :: Python :: 3.2",
+    "Programming Language :: Python :: 3",
+    "Programming Language :: Python :: 3 :: Only",
+    "Programming Language :: Python :: 3.7",
+    "Programming Language :: Python :: 3.8",
+    "Programming Language :: Python :: 3.9",
+    "Programming Language :: Python :: 3.10",
+    "Programming Language :: Python :: 3.11",
     "Topic :: Software Development :: Libraries :: Python Modules",
   ],
   long_description = """\
@@ -1 +1,24 @@
 __version__ = '0.2.2'
+
+import importlib
+
+# Public names and the modules that define them. They are imported on
+# first use, so loading the package, e.g. for the thin compile client,
+# does not load the compiler or multiprocessing.
+exports = {
+  'Compiler': 'wieldymarkup.compile',
+  'CompilerException': 'wieldymarkup.compile',
+  'UnterminatedTextException': 'wieldymarkup.compile',
+  'iter_compile': 'wieldymarkup.compile',
+  'compile_many': 'wieldymarkup.parallel',
+  'compile_sharded': 'wieldymarkup.parallel',
+}
+
+__all__ = sorted(exports)
+
+def __getattr__(name):
+  if name not in exports:
+    raise AttributeError("module 'wieldymarkup' has no attribute " + repr(name))
+  value = getattr(importlib.import_module(exports[name]), name)
+  globals()[name] = value
+  return value
@@ -5,79 +5,120 @@
 :license: See LICENSE.txt for details.
 """
 
-import sys, os
+import sys, os, argparse
 
-def compile_file_from_path(filepath, strict=True, compress=False):
-  try:
-    ext = filepath.split('/')[-1].split('.')[-1]
-  except Exception:
-    if strict:
-      raise Exception("Could not get extension in " + str(filepath))
-    else:
-      return
+if __package__ in (None, ""):
+  # Run as "python /path/to/wieldymarkup": make the package importable
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+cache_filename = ".wieldymarkup-cache.json"
+
+def get_argument_parser():
+  parser = argparse.ArgumentParser(prog="wieldymarkup",
+    description="Compile WieldyMarkup (.wml) files into .html files next to them. "
+      "Run \"wieldymarkup serve -h\" or \"wieldymarkup client -h\" for the compile server.")
+  parser.add_argument("files", nargs="*", metavar="FILE",
+    help="a .wml file to compile")
+  parser.add_argument("-c", "--compress", action="store_true",
+    help="remove whitespace between HTML tags")
+  parser.add_argument("-m", "--minify", action="store_true",
+    help="like -c, and also collapse whitespace in text and drop optional quotes and end tags")
+  parser.add_argument("-z", "--precompress", action="store_true",
+    help="also write .html.gz, and .html.br if the brotli module is installed, for outputs of 1 KB or more")
+  parser.add_argument("-d", dest="directory", metavar="DIR",
+    help="compile the .wml files in DIR instead of the given files")
+  parser.add_argument("-r", dest="recursive", action="store_true",
+    help="with -d, also compile .wml files in subdirectories")
+  parser.add_argument("-f", "--force", action="store_true",
+    help="skip files without the .wml extension instead of failing")
+  parser.add_argument("-j", "--jobs", type=int, default=None, metavar="N",
+    help="number of worker processes (default: number of CPUs)")
+  parser.add_argument("--cache-file", metavar="PATH",
+    help="build manifest used to skip unchanged files (default: " + cache_filename + " in the -d directory)")
+  parser.add_argument("--no-cache", action="store_true",
+    help="recompile every file, ignoring the build manifest")
+  parser.add_argument("--watch", action="store_true",
+    help="with -d, keep running and recompile .wml files as they change")
+  parser.add_argument("--check", action="store_true",
+    help="only report every error in the files, without writing any output")
+  parser.add_argument("--report", metavar="PATH",
+    help="write a JSON report of every file's sizes, time, cache status and error to PATH")
+  parser.add_argument("--report-slowest", type=int, default=10, metavar="N",
+    help="number of slowest files listed in the report (default: 10)")
+  parser.add_argument("--profile", action="store_true",
+    help="print the time spent in each compiler phase for every compiled file")
+  return parser
+
+def main(argv=None):
+  argv = sys.argv[1:] if argv is None else argv
+  # The client is dispatched before the compiler is imported, to start fast
+  if len(argv) > 0 and argv[0] == "client":
+    from wieldymarkup import client
+    return client.main(argv[1:])
+  if len(argv) > 0 and argv[0] == "serve":
+    from wieldymarkup import server
+    return server.main(argv[1:])
   
-  if ext != 'wml':
-    if strict:
-      raise Exception("Invalid extension (" + str(filepath) + "). Must be .wml.")
-    else:
-      return
+  from wieldymarkup.build import find_source_files, build_files, check_files, write_errors, \
+    write_profile, write_report
+  from wieldymarkup.cache import BuildCache
   
-  def read_in_chunks(file_object, chunk_size=1024):
-    """Lazy function (generator) to read a file piece by piece.
-    Default chunk size: 1k."""
-    while True:
-      data = file_object.read(chunk_size)
-      if not data:
-        break
-      yield data
+  parser = get_argument_parser()
+  args = parser.parse_args(argv)
   
-  with open(filepath, 'rb') as f:
-    for piece in read_in_chunks(f):
-      data = piece
+  if args.jobs is not None and args.jobs < 1:
+    parser.error("-j must be at least 1.")
   
-  from compile import Compiler
+  if args.watch and args.directory is None:
+    parser.error("--watch requires -d.")
   
-  html = Compiler(text=data, compress=compress).output
+  if args.check and args.watch:
+    parser.error("--check cannot be used with --watch.")
   
-  temp = filepath.split('/')
-  temp.pop()
-  filename = '/'.join(temp) + '/' + filepath.split('/')[-1].split('.')[0] + '.html'
-  with open(filename, 'wb') as f:
-    f.write(html)
-
-args = sys.argv
-
-if args[0].split('/')[0] == "wieldymarkup":
-  args = args[1:]
-
-compress = False
-if "-c" in args or "--compress" in args:
-  compress = True
-  args = [arg for arg in args if arg not in ["-c", "--compress"]]
-
-if "-d" in args:
-  d_index = args.index("-d")
-  if len(args) < d_index + 1:
-    raise Exception("The -d argument must be followed immediately by a directory path in which to compiler .wml files.")
+  if args.check and args.report is not None:
+    parser.error("--report cannot be used with --check.")
   
-  dir_path = str(args[d_index + 1])
-  if not os.path.isdir(dir_path):
-    raise Exception("Invalid directory path following -d argument.")
-    
-  if "-r" in args:
-    for root, dirs, files in os.walk(dir_path):
-      compile_file_from_path(os.path.join(root, name), strict=False, compress=compress)
+  if args.directory is not None:
+    if not os.path.isdir(args.directory):
+      parser.error("Invalid directory path following -d argument.")
+    filepaths = find_source_files(args.directory, recursive=args.recursive)
   else:
-    for filepath in os.listdir(dir_path):
-      if not os.path.isdir(os.path.join(dir_path, filepath)):
-        compile_file_from_path(os.path.join(dir_path, filepath), strict=False, compress=compress)
+    filepaths = args.files
   
-else:
-  strict = True
-  if "-f" in args or "--force" in args:
-    strict = False
-    args = [arg for arg in args if arg not in ["-f", "--force"]]
+  if args.check:
+    return 1 if write_errors(check_files(filepaths, strict=not args.force, jobs=args.jobs), sys.stderr) else 0
   
-  for filepath in args:
-    compile_file_from_path(filepath, strict=strict, compress=compress)
+  cache_path = args.cache_file
+  if cache_path is None and args.directory is not None:
+    cache_path = os.path.join(args.directory, cache_filename)
   
+  cache = None
+  if cache_path is not None:
+    cache = BuildCache(cache_path)
+    # A forced rebuild still refreshes the manifest for the next build
+    if not args.no_cache:
+      cache.load()
+  
+  results = build_files(filepaths, strict=not args.force, compress=args.compress, minify=args.minify,
+    precompress=args.precompress,
+    jobs=args.jobs, cache=cache, profile=args.profile)
+  
+  if cache is not None:
+    cache.save()
+  
+  failed = write_errors(results, sys.stderr)
+  if args.report is not None:
+    write_report(results, args.report, args.report_slowest)
+  if args.profile:
+    write_profile(results, sys.stdout)
+  
+  if args.watch:
+    from wieldymarkup.watch import Watcher
+    Watcher(args.directory, recursive=args.recursive, compress=args.compress, minify=args.minify,
+      precompress=args.precompress, cache=cache).run()
+    return 0
+  
+  return 1 if failed else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
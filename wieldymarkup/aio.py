@@ -0,0 +1,67 @@
+"""
+Coroutines that compile .wml files without blocking an asyncio event loop.
+Disk reads and writes run in the loop's default executor, and compiles in
+the executor passed in, so a process pool can take the CPU work.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import io, time, asyncio
+
+from wieldymarkup.build import BuildResult, is_source_file, get_output_path, find_source_files, \
+  write_if_changed
+from wieldymarkup.parallel import compile_item
+
+def read_source(filepath):
+  with io.open(filepath, 'r', encoding='utf-8', newline='') as f:
+    return f.read()
+
+async def compile_file(filepath, strict=True, compress=False, executor=None, minify=False):
+  """
+  Compiles the .wml file at filepath into an .html file next to it and
+  returns the path of the .html file. The compile runs in executor, or in
+  the loop's default executor if it is None. The .html file is only
+  replaced if the compile succeeds and its content changed.
+  """
+  if not is_source_file(filepath, strict):
+    return
+  
+  loop = asyncio.get_running_loop()
+  text = await loop.run_in_executor(None, read_source, filepath)
+  html = await loop.run_in_executor(executor, compile_item, text, compress, minify, filepath)
+  if isinstance(html, Exception):
+    raise html
+  
+  filename = get_output_path(filepath)
+  await loop.run_in_executor(None, write_if_changed, filename, html.encode('utf-8'))
+  return filename
+
+async def compile_tree(dir_path, recursive=False, compress=False, executor=None, limit=64,
+    callback=None, minify=False):
+  """
+  Compiles the .wml files in dir_path, and in all of its subdirectories if
+  recursive is set, with at most limit files open or compiling at a time.
+  callback, if given, is called with the BuildResult of each file as soon
+  as it completes. Returns the BuildResults in the order of the sorted
+  file paths. A failing file does not stop the others.
+  """
+  loop = asyncio.get_running_loop()
+  filepaths = await loop.run_in_executor(None, find_source_files, dir_path, recursive)
+  semaphore = asyncio.Semaphore(limit)
+  
+  async def build(filepath):
+    async with semaphore:
+      start = time.time()
+      try:
+        output = await compile_file(filepath, compress=compress, executor=executor, minify=minify)
+      except Exception as e:
+        result = BuildResult(filepath, error=str(e), elapsed=time.time() - start,
+          line_number=getattr(e, 'line_number', None))
+      else:
+        result = BuildResult(filepath, output=output, elapsed=time.time() - start)
+    if callback is not None:
+      callback(result)
+    return result
+  
+  return await asyncio.gather(*[build(filepath) for filepath in filepaths])
@@ -0,0 +1,290 @@
+"""
+Benchmarks for the compiler on synthetic documents. Run it with
+
+  python -m wieldymarkup.benchmark
+
+to time Compiler.compile in both compress modes on each corpus, report
+throughput and peak memory, and compare them with the baseline stored next
+to this module. Add --save to store the current results as the new
+baseline.
+
+Throughput is compared relative to a calibration workload of plain Python
+text processing on the same document, run just before each compile. The
+compile's speed relative to it carries over between machines, and between
+a busy and an idle one, where megabytes per second do not, so the
+baseline only stores the relative speed.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import sys, os, io, re, json, time, random, argparse, statistics, tracemalloc
+
+if __package__ in (None, ""):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wieldymarkup.compile import Compiler
+
+# Found next to this module, wherever it is run from
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark-baseline.json")
+
+words = (
+  "lorem ipsum dolor sit amet consectetur adipisicing elit sed do eiusmod "
+  "tempor incididunt ut labore et dolore magna aliqua"
+).split()
+
+tags = ["div", "span", "li", "a", "p", "section", "td"]
+
+def get_words(rng, length):
+  """
+  Returns random words joined by spaces, about length characters long.
+  """
+  text = []
+  size = 0
+  while size < length:
+    word = rng.choice(words)
+    text.append(word)
+    size += len(word) + 1
+  return ' '.join(text)
+
+def get_element(rng, index, attribute_count):
+  parts = [rng.choice(tags) + ".c" + str(index % 7) + ".row"]
+  for i in range(attribute_count):
+    parts.append("data-a" + str(i) + "=v" + str(rng.randint(0, 9)))
+  return ' '.join(parts)
+
+def generate_document(size=65536, depth=4, line_length=40, attribute_count=1,
+    chain_length=1, multiline_lines=0, embedded_ratio=0.0, seed=0):
+  """
+  Returns a valid WieldyMarkup document of at least size characters made of
+  blocks nested depth levels deep. Each leaf line has attribute_count
+  attributes, chain_length tags joined with the multi-tag delimiter, and
+  inner text of about line_length characters, spread over multiline_lines
+  extra lines if set. About embedded_ratio of the leaves are back tick
+  lines instead.
+  """
+  rng = random.Random(seed)
+  indent = "  "
+  lines = []
+  total = 0
+  index = 0
+  while total < size:
+    for level in range(depth):
+      line = indent * level + get_element(rng, index, attribute_count)
+      lines.append(line)
+      total += len(line) + 1
+      index += 1
+    
+    for leaf in range(4):
+      prefix = indent * depth
+      if rng.random() < embedded_ratio:
+        line = prefix + "`<b>" + get_words(rng, line_length) + "</b>"
+      else:
+        chain = [get_element(rng, index + i, attribute_count) for i in range(chain_length)]
+        line = prefix + " \\-\\ ".join(chain)
+        if multiline_lines > 0:
+          line += " <" + get_words(rng, line_length)
+          for i in range(multiline_lines - 1):
+            line += "\n" + prefix + indent + get_words(rng, line_length)
+          line += "\n" + prefix + indent + get_words(rng, line_length) + ">"
+        else:
+          line += " <" + get_words(rng, line_length) + ">"
+      lines.append(line)
+      total += len(line) + 1
+      index += 1
+  
+  return '\n'.join(lines) + '\n'
+
+# (name, generate_document keyword arguments)
+cases = [
+  ("size-64k", {'size': 65536}),
+  ("size-1m", {'size': 1048576}),
+  ("size-4m", {'size': 4194304}),
+  ("depth-32", {'depth': 32}),
+  ("depth-256", {'depth': 256, 'size': 262144}),
+  ("line-1k", {'line_length': 1024}),
+  ("line-16k", {'line_length': 16384, 'size': 262144}),
+  ("attributes-16", {'attribute_count': 16}),
+  ("attributes-64", {'attribute_count': 64}),
+  ("chain-8", {'chain_length': 8}),
+  ("chain-64", {'chain_length': 64}),
+  ("chain-1024", {'chain_length': 1024, 'size': 262144}),
+  ("multiline-10", {'multiline_lines': 10}),
+  ("multiline-200", {'multiline_lines': 200, 'size': 262144}),
+  ("embedded-50", {'embedded_ratio': 0.5}),
+]
+
+quick_cases = ["size-64k", "depth-32", "line-1k", "attributes-16", "chain-8", "multiline-10", "embedded-50"]
+
+word_pattern = re.compile(r"\S+")
+
+def run_calibration(text):
+  """
+  Turns each line of text into an HTML element with plain string and
+  regular expression operations, as a measure of the speed of the
+  interpreter and machine that does not depend on the compiler.
+  """
+  fragments = []
+  for line in text.split("\n"):
+    line_words = word_pattern.findall(line.lstrip())
+    if len(line_words) == 0:
+      continue
+    tag = line_words[0].split(".")[0]
+    fragments.append("<" + tag + ">" + " ".join(line_words[1:]).strip("<>") + "</" + tag + ">")
+  return "\n".join(fragments)
+
+def measure_speed(text, compress=False, repeat=5):
+  """
+  Returns (megabytes per second, relative speed) for compiling text: the
+  best throughput of repeat compiles, and the median of the compile's
+  speed relative to run_calibration on text, run just before each one, so
+  both see the same load on the machine.
+  """
+  megabytes = len(text.encode('utf-8')) / 1e6
+  compiler = Compiler()
+  best = None
+  ratios = []
+  for i in range(repeat):
+    start = time.perf_counter()
+    run_calibration(text)
+    calibration_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    compiler.compile(text, compress=compress)
+    seconds = time.perf_counter() - start
+    if best is None or seconds < best:
+      best = seconds
+    ratios.append(calibration_seconds / seconds)
+  return megabytes / best, statistics.median(ratios)
+
+def measure_peak_memory(text, compress=False):
+  """
+  Returns the peak number of bytes allocated while compiling text, not
+  counting text itself.
+  """
+  compiler = Compiler()
+  tracemalloc.start()
+  try:
+    compiler.compile(text, compress=compress)
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+def run_case(kwargs, repeat=5):
+  """
+  Returns the results of a case: its size, and for each compress mode, the
+  throughput in megabytes per second, the throughput relative to the
+  calibration workload, and the peak memory.
+  """
+  text = generate_document(**kwargs)
+  result = {'megabytes': round(len(text.encode('utf-8')) / 1e6, 3)}
+  for mode, compress in (("pretty", False), ("compressed", True)):
+    mb_per_s, relative_speed = measure_speed(text, compress, repeat)
+    result[mode + '_mb_per_s'] = round(mb_per_s, 3)
+    result[mode + '_relative_speed'] = round(relative_speed, 4)
+    result[mode + '_peak_kb'] = round(measure_peak_memory(text, compress) / 1024.0, 1)
+  return result
+
+def get_baseline_result(result):
+  """
+  Returns the part of a case's result kept in a baseline, which leaves out
+  the throughputs that only hold on the machine they were measured on.
+  """
+  return dict((key, value) for key, value in result.items() if not key.endswith('_mb_per_s'))
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+  """
+  Returns a message for each relative speed that fell, or peak memory that
+  grew, by more than tolerance relative to baseline.
+  """
+  regressions = []
+  for name in sorted(results):
+    if name not in baseline:
+      continue
+    for key in sorted(results[name]):
+      if key not in baseline[name] or not key.endswith(('_relative_speed', '_peak_kb')):
+        continue
+      old = baseline[name][key]
+      new = results[name][key]
+      if key.endswith('_relative_speed'):
+        regressed = new < old * (1 - tolerance)
+      else:
+        regressed = new > old * (1 + tolerance)
+      if regressed:
+        regressions.append("%s %s: %s -> %s" % (name, key, old, new))
+  return regressions
+
+def format_row(name, result, baseline_result=None):
+  """
+  Formats a case's result as a row of the table. Throughputs are followed
+  by the change in relative speed from baseline_result, and peak memory by
+  its change.
+  """
+  row = "%-16s %8.3f" % (name, result['megabytes'])
+  for key, compared_key in (
+      ('pretty_mb_per_s', 'pretty_relative_speed'),
+      ('compressed_mb_per_s', 'compressed_relative_speed'),
+      ('pretty_peak_kb', 'pretty_peak_kb'),
+      ('compressed_peak_kb', 'compressed_peak_kb')):
+    cell = "%.1f" % result[key]
+    if baseline_result is not None and baseline_result.get(compared_key):
+      cell += " (%+.0f%%)" % ((result[compared_key] / baseline_result[compared_key] - 1) * 100)
+    row += " %20s" % cell
+  return row
+
+def get_argument_parser():
+  parser = argparse.ArgumentParser(prog="python -m wieldymarkup.benchmark",
+    description="Benchmark the WieldyMarkup compiler on synthetic documents.")
+  parser.add_argument("--baseline", default=baseline_path, metavar="PATH",
+    help="baseline results to compare with (default: " + baseline_path + ")")
+  parser.add_argument("--save", action="store_true",
+    help="store these results as the new baseline")
+  parser.add_argument("--quick", action="store_true",
+    help="run only the smaller cases")
+  parser.add_argument("-k", dest="pattern", metavar="TEXT",
+    help="run only the cases whose name contains TEXT")
+  parser.add_argument("--repeat", type=int, default=5, metavar="N",
+    help="compiles per measurement; the fastest throughput and the median relative speed are kept (default: 5)")
+  parser.add_argument("--tolerance", type=float, default=0.25,
+    help="relative change that counts as a regression (default: 0.25)")
+  return parser
+
+def main(argv=None, stream=sys.stdout, error_stream=sys.stderr):
+  args = get_argument_parser().parse_args(sys.argv[1:] if argv is None else argv)
+  
+  baseline = {}
+  if os.path.exists(args.baseline):
+    with io.open(args.baseline, 'r', encoding='utf-8') as f:
+      baseline = json.load(f)
+  elif not args.save:
+    # Nothing to compare with would pass every run
+    error_stream.write("No baseline at " + args.baseline + "; run with --save to record one.\n")
+    return 1
+  
+  stream.write("%-16s %8s %20s %20s %20s %20s\n" % (
+    "case", "MB", "pretty MB/s", "compressed MB/s", "pretty peak KB", "compressed peak KB"))
+  results = {}
+  for name, kwargs in cases:
+    if args.quick and name not in quick_cases:
+      continue
+    if args.pattern is not None and args.pattern not in name:
+      continue
+    results[name] = run_case(kwargs, args.repeat)
+    stream.write(format_row(name, results[name], baseline.get(name)) + "\n")
+    stream.flush()
+  
+  if args.save:
+    for name in results:
+      baseline[name] = get_baseline_result(results[name])
+    with io.open(args.baseline, 'w', encoding='utf-8') as f:
+      f.write(json.dumps(baseline, indent=1, sort_keys=True))
+    stream.write("Saved baseline to " + args.baseline + "\n")
+    return 0
+  
+  regressions = compare_to_baseline(results, baseline, args.tolerance)
+  for regression in regressions:
+    stream.write("REGRESSION " + regression + "\n")
+  return 1 if regressions else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,447 @@
+"""
+Compiles .wml files on disk into .html files next to them. Used by the
+command line interface in __main__.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import os, io, json, time, gzip, mmap, hashlib, binascii, functools, multiprocessing
+
+from wieldymarkup.compile import Compiler, CompilerStats
+from wieldymarkup.cache import get_file_signature, get_file_digest
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+# Sources of at least this many bytes are compiled from a memory mapping
+mmap_threshold = 16 * 1024 * 1024
+
+# Outputs smaller than this many bytes are not precompressed
+precompress_threshold = 1024
+
+def get_output_path(filepath):
+  filename = os.path.basename(filepath)
+  return os.path.join(os.path.dirname(filepath), filename.split('.')[0] + '.html')
+
+def is_source_file(filepath, strict=True):
+  """
+  Returns whether filepath has the .wml extension. When strict is set, an
+  exception is raised instead of returning False.
+  """
+  try:
+    ext = filepath.split('/')[-1].split('.')[-1]
+  except Exception:
+    if strict:
+      raise Exception("Could not get extension in " + str(filepath))
+    else:
+      return False
+  
+  if ext != 'wml':
+    if strict:
+      raise Exception("Invalid extension (" + str(filepath) + "). Must be .wml.")
+    else:
+      return False
+  
+  return True
+
+def compile_file_from_path(filepath, strict=True, compress=False, compiler=None, minify=False,
+    precompress=False):
+  """
+  Compiles the .wml file at filepath into an .html file next to it and
+  returns the path of the .html file. With precompress, .html.gz and, if
+  the brotli module is installed, .html.br files are written next to it.
+  """
+  if not is_source_file(filepath, strict):
+    return
+  
+  filename = get_output_path(filepath)
+  
+  if os.path.getsize(filepath) >= mmap_threshold and not minify:
+    # Map the source into memory and stream the output to a temporary file,
+    # then compare that with the existing output
+    temp_path, fd = create_temp_file(filename)
+    try:
+      with io.open(fd, 'w', encoding='utf-8', newline='') as f:
+        (Compiler() if compiler is None else compiler).compile_path(filepath, f, compress=compress)
+      changed = not is_same_file(temp_path, filename)
+      if changed:
+        os.replace(temp_path, filename)
+      else:
+        os.remove(temp_path)
+    except Exception:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+      raise
+    
+    if precompress:
+      with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+          write_precompressed(filename, b"", changed)
+        else:
+          mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+          try:
+            write_precompressed(filename, mapping, changed)
+          finally:
+            mapping.close()
+    return filename
+  
+  with io.open(filepath, 'r', encoding='utf-8', newline='') as source:
+    text = source.read()
+  compiler = Compiler() if compiler is None else compiler
+  html = compiler.compile(text, compress=compress, source_path=filepath, minify=minify).output
+  data = html.encode('utf-8')
+  changed = write_if_changed(filename, data)
+  if precompress:
+    write_precompressed(filename, data, changed)
+  return filename
+
+def gzip_compress(data):
+  # gzip.compress only takes mtime from Python 3.8; mtime=0 keeps the
+  # output the same for the same input
+  stream = io.BytesIO()
+  with gzip.GzipFile(fileobj=stream, mode='wb', compresslevel=9, mtime=0) as f:
+    f.write(data)
+  return stream.getvalue()
+
+def get_precompressors():
+  """
+  Returns (extension, compress) pairs for the precompressed copies to
+  write, where compress turns bytes into compressed bytes.
+  """
+  precompressors = [('.gz', gzip_compress)]
+  if brotli is not None:
+    precompressors.append(('.br', brotli.compress))
+  return precompressors
+
+def write_precompressed(filename, data, changed=True):
+  """
+  Writes compressed copies of data, the content of filename, next to it,
+  or removes them if data is smaller than precompress_threshold. Unless
+  changed is set, copies that are newer than filename are assumed to be
+  current and left alone, without compressing data again.
+  """
+  for extension, compress in get_precompressors():
+    path = filename + extension
+    if len(data) < precompress_threshold:
+      if os.path.exists(path):
+        os.remove(path)
+    elif changed or not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(filename):
+      write_if_changed(path, compress(data))
+
+def remove_output(output):
+  """
+  Removes output, an .html file written by a build, along with its
+  precompressed copies, where they exist.
+  """
+  for extension in [""] + [extension for extension, compress in get_precompressors()]:
+    if os.path.exists(output + extension):
+      os.remove(output + extension)
+
+def create_temp_file(filename):
+  """
+  Creates an empty file next to filename and returns its path and an open
+  file descriptor. Unlike tempfile.mkstemp, the file gets the permissions
+  allowed by the umask, which it keeps when it replaces filename.
+  """
+  while True:
+    temp_path = filename + "." + binascii.hexlify(os.urandom(4)).decode('ascii') + ".tmp"
+    try:
+      return temp_path, os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    except FileExistsError:
+      continue
+
+def is_same_file(filepath, other_filepath):
+  """
+  Returns whether both files exist and have the same content, comparing
+  their sizes before their hashes.
+  """
+  try:
+    if os.path.getsize(filepath) != os.path.getsize(other_filepath):
+      return False
+  except OSError:
+    return False
+  return get_file_digest(filepath) == get_file_digest(other_filepath)
+
+def write_if_changed(filename, data):
+  """
+  Replaces filename with the bytes in data, unless it already holds them,
+  and returns whether it was written. The data goes to a temporary file in
+  one write and is moved into place with os.replace, so readers never see
+  a partial file and an unchanged file keeps its mtime.
+  """
+  try:
+    if os.path.getsize(filename) == len(data) and get_file_digest(filename) == hashlib.sha1(data).hexdigest():
+      return False
+  except OSError:
+    pass
+  
+  temp_path, fd = create_temp_file(filename)
+  try:
+    with io.open(fd, 'wb') as f:
+      f.write(data)
+    os.replace(temp_path, filename)
+  except Exception:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+    raise
+  return True
+
+def find_source_files(dir_path, recursive=False):
+  """
+  Returns the sorted paths of the .wml files in dir_path, and in all of its
+  subdirectories if recursive is set.
+  """
+  filepaths = []
+  if recursive:
+    for root, dirs, files in os.walk(dir_path):
+      for name in files:
+        if name.endswith('.wml'):
+          filepaths.append(os.path.join(root, name))
+  else:
+    for name in os.listdir(dir_path):
+      filepath = os.path.join(dir_path, name)
+      if name.endswith('.wml') and not os.path.isdir(filepath):
+        filepaths.append(filepath)
+  return sorted(filepaths)
+
+class BuildResult(object):
+  """
+  The outcome of compiling one source file. error holds the message of the
+  exception that stopped the compile, or None on success. cached is set
+  when the build cache showed the file was up to date and it was skipped.
+  signature is the (mtime_ns, size, digest) of the source read just before
+  compiling, when it was requested. elapsed is the wall time of the compile
+  in seconds, and stats its CompilerStats when profiling. includes maps
+  the absolute path of each partial the source included, directly or not,
+  to the (mtime_ns, size, digest) of the content the worker parsed.
+  errors holds the message of every error a check found, of which error
+  is the first. line_number is the line error was found on, if known.
+  """
+  
+  def __init__(self, source, output=None, error=None, cached=False, signature=None,
+      elapsed=0.0, stats=None, includes=(), errors=(), line_number=None):
+    self.source = source
+    self.output = output
+    self.error = error
+    self.cached = cached
+    self.signature = signature
+    self.elapsed = elapsed
+    self.stats = stats
+    self.includes = includes
+    self.errors = errors
+    self.line_number = line_number
+
+def build_file(filepath, strict=True, compress=False, signature=False, profile=False, minify=False,
+    precompress=False):
+  compiler = Compiler(profile=profile)
+  start = time.time()
+  try:
+    file_signature = get_file_signature(filepath) if signature else None
+    output = compile_file_from_path(filepath, strict=strict, compress=compress, compiler=compiler,
+      minify=minify, precompress=precompress)
+  except Exception as e:
+    return BuildResult(filepath, error=str(e), elapsed=time.time() - start,
+      line_number=getattr(e, 'line_number', None))
+  return BuildResult(filepath, output=output, signature=file_signature,
+    elapsed=time.time() - start, stats=compiler.stats if profile and output is not None else None,
+    includes=dict(compiler.includes))
+
+def build_files(filepaths, strict=True, compress=False, jobs=None, cache=None, profile=False,
+    minify=False, precompress=False):
+  """
+  Compiles filepaths across jobs worker processes (one per CPU by default)
+  and returns a BuildResult for each, in the order of filepaths. A failing
+  file does not stop the others. Files that cache, a BuildCache, shows to
+  be up to date are skipped, and cache is updated with the new results.
+  """
+  filepaths = list(filepaths)
+  options = {'compress': compress}
+  if minify:
+    options['minify'] = True
+  if precompress:
+    options['precompress'] = True
+  results = [None] * len(filepaths)
+  stale_indexes = []
+  for i, filepath in enumerate(filepaths):
+    if cache is not None and cache.is_fresh(filepath, options):
+      results[i] = BuildResult(filepath, output=get_output_path(filepath), cached=True)
+    else:
+      stale_indexes.append(i)
+  
+  stale_filepaths = [filepaths[i] for i in stale_indexes]
+  stale_results = run_jobs(
+    functools.partial(build_file, strict=strict, compress=compress, signature=cache is not None,
+      profile=profile, minify=minify, precompress=precompress),
+    stale_filepaths,
+    jobs
+  )
+  
+  for i, result in zip(stale_indexes, stale_results):
+    results[i] = result
+    if cache is not None:
+      if result.error is None and result.output is not None:
+        cache.update(result.source, result.output, options, result.signature, result.includes)
+      else:
+        cache.discard(result.source)
+  
+  return results
+
+def check_file(filepath, strict=True):
+  """
+  Validates the .wml file at filepath without writing any output, and
+  returns a BuildResult with every error found.
+  """
+  start = time.time()
+  try:
+    if not is_source_file(filepath, strict):
+      return BuildResult(filepath, elapsed=time.time() - start)
+    with io.open(filepath, 'r', encoding='utf-8', newline='') as source:
+      text = source.read()
+    exceptions = Compiler().validate(text, source_path=filepath)
+  except Exception as e:
+    exceptions = [e]
+  return BuildResult(filepath, error=str(exceptions[0]) if exceptions else None,
+    elapsed=time.time() - start, errors=tuple(str(e) for e in exceptions),
+    line_number=getattr(exceptions[0], 'line_number', None) if exceptions else None)
+
+def check_files(filepaths, strict=True, jobs=None):
+  """
+  Validates filepaths across jobs worker processes (one per CPU by
+  default) and returns a BuildResult for each, in the order of filepaths.
+  """
+  return run_jobs(functools.partial(check_file, strict=strict), filepaths, jobs)
+
+def write_errors(results, stream):
+  """
+  Writes a "source: error" line to stream for each error of each failed
+  BuildResult, in order, and returns the number of failed results.
+  """
+  failed = 0
+  for result in results:
+    if result.error is not None:
+      for error in result.errors or (result.error,):
+        stream.write(result.source + ": " + error + "\n")
+      failed += 1
+  return failed
+
+def get_file_size(filepath):
+  try:
+    return os.path.getsize(filepath)
+  except (OSError, TypeError):
+    return 0
+
+def get_report(results, slowest=10):
+  """
+  Returns a build report for a list of BuildResults, ready to be written as
+  JSON: a record for each file, in order, the totals, and the slowest
+  compiled files, at most slowest of them. A file's status is "compiled",
+  "cached" if the build cache skipped it, "skipped" if it was not a .wml
+  file, or "failed". Sizes are in bytes and times in seconds.
+  """
+  files = []
+  totals = {'files': 0, 'compiled': 0, 'cached': 0, 'skipped': 0, 'failed': 0,
+    'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+  for result in results:
+    if result.error is not None:
+      status = 'failed'
+    elif result.cached:
+      status = 'cached'
+    elif result.output is None:
+      status = 'skipped'
+    else:
+      status = 'compiled'
+    
+    record = {
+      'source': result.source,
+      'output': None if status == 'failed' else result.output,
+      'status': status,
+      'bytes_in': get_file_size(result.source),
+      'bytes_out': 0 if status == 'failed' else get_file_size(result.output),
+      'seconds': round(result.elapsed, 6),
+      'error': result.error,
+      'line_number': result.line_number,
+    }
+    files.append(record)
+    
+    totals['files'] += 1
+    totals[status] += 1
+    totals['bytes_in'] += record['bytes_in']
+    totals['bytes_out'] += record['bytes_out']
+    totals['seconds'] += result.elapsed
+  totals['seconds'] = round(totals['seconds'], 6)
+  
+  compiled = [record for record in files if record['status'] == 'compiled']
+  compiled.sort(key=lambda record: record['seconds'], reverse=True)
+  return {
+    'files': files,
+    'totals': totals,
+    'slowest': [{'source': record['source'], 'seconds': record['seconds']} for record in compiled[:slowest]],
+  }
+
+def write_report(results, filepath, slowest=10):
+  """
+  Writes the build report of results to filepath as JSON.
+  """
+  data = json.dumps(get_report(results, slowest), indent=1, sort_keys=True)
+  write_if_changed(filepath, data.encode('utf-8'))
+
+profile_columns = (
+  ('level ms', 'process_current_level'),
+  ('close ms', 'close_lower_level_tags'),
+  ('selector ms', 'process_selector'),
+  ('attributes ms', 'process_attributes'),
+  ('inner text ms', 'process_inner_text'),
+  ('output ms', 'output'),
+)
+
+def write_profile(results, stream):
+  """
+  Writes a table of the CompilerStats of each profiled BuildResult to
+  stream, followed by their totals.
+  """
+  profiled = [result for result in results if result.stats is not None]
+  if len(profiled) == 0:
+    return
+  
+  width = max(len("TOTAL"), max(len(result.source) for result in profiled))
+  header = ["file".ljust(width), "%7s" % "lines", "%7s" % "tags", "%9s" % "KB in", "%9s" % "KB out"]
+  header += ["%13s" % name for name, phase in profile_columns]
+  header.append("%9s" % "wall ms")
+  stream.write(' '.join(header) + "\n")
+  
+  def write_row(name, stats, elapsed):
+    row = [name.ljust(width), "%7d" % stats.lines, "%7d" % stats.tags,
+      "%9.1f" % (stats.bytes_in / 1024.0), "%9.1f" % (stats.bytes_out / 1024.0)]
+    row += ["%13.2f" % (stats.times[phase] * 1000) for name, phase in profile_columns]
+    row.append("%9.2f" % (elapsed * 1000))
+    stream.write(' '.join(row) + "\n")
+  
+  total = CompilerStats()
+  for result in profiled:
+    write_row(result.source, result.stats, result.elapsed)
+    total.add(result.stats)
+  write_row("TOTAL", total, sum(result.elapsed for result in profiled))
+
+def run_jobs(worker, items, jobs=None):
+  """
+  Returns [worker(item) for item in items], computed across jobs worker
+  processes (one per CPU by default).
+  """
+  items = list(items)
+  if jobs is None:
+    jobs = multiprocessing.cpu_count()
+  jobs = max(1, min(jobs, len(items)))
+  
+  if jobs == 1:
+    return [worker(item) for item in items]
+  
+  pool = multiprocessing.Pool(processes=jobs)
+  try:
+    chunksize = max(1, len(items) // (jobs * 4))
+    return pool.map(worker, items, chunksize)
+  finally:
+    pool.close()
+    pool.join()
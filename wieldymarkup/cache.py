@@ -0,0 +1,184 @@
+"""
+A persistent manifest of compiled sources that lets the command line
+interface skip .wml files that have not changed since the last build.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import os, io, json, hashlib
+
+from wieldymarkup import __version__
+
+def get_file_digest(filepath, chunk_size=65536):
+  digest = hashlib.sha1()
+  with open(filepath, 'rb') as f:
+    while True:
+      data = f.read(chunk_size)
+      if not data:
+        break
+      digest.update(data)
+  return digest.hexdigest()
+
+def get_file_signature(filepath):
+  """
+  Returns (mtime_ns, size, digest) of the file at filepath.
+  """
+  stat = os.stat(filepath)
+  return stat.st_mtime_ns, stat.st_size, get_file_digest(filepath)
+
+class BuildCache(object):
+  """
+  Maps each source file to the mtime, size and SHA-1 of its content and the
+  compile options it was last built with, along with its output path and
+  the same signature for each partial it included. The manifest is stored
+  as JSON at path, with source paths relative to the manifest's directory,
+  and is discarded when the compiler version changes.
+  """
+  
+  def __init__(self, path):
+    self.path = path
+    self.base_path = os.path.dirname(os.path.abspath(path))
+    self.entries = {}
+    self.changed = False
+    # Reverse dependency index from each partial to the sources that
+    # include it, built when first needed
+    self.dependents = None
+  
+  def load(self):
+    try:
+      with io.open(self.path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+      return self
+    
+    if isinstance(manifest, dict) and manifest.get('version') == __version__:
+      self.entries = manifest.get('files', {})
+      self.dependents = None
+    return self
+  
+  def save(self):
+    if not self.changed:
+      return self
+    
+    # Forget sources that no longer exist
+    for key in list(self.entries):
+      if not os.path.exists(os.path.join(self.base_path, key)):
+        del self.entries[key]
+    
+    temp_path = self.path + '.tmp'
+    with io.open(temp_path, 'w', encoding='utf-8') as f:
+      f.write(json.dumps({'version': __version__, 'files': self.entries}, indent=1, sort_keys=True))
+    os.replace(temp_path, self.path)
+    self.changed = False
+    return self
+  
+  def get_key(self, filepath):
+    return os.path.relpath(os.path.abspath(filepath), self.base_path)
+  
+  def get_path(self, key):
+    return os.path.normpath(os.path.join(self.base_path, key))
+  
+  def is_fresh(self, filepath, options):
+    """
+    Returns whether filepath was built with options by an earlier build,
+    neither it nor the partials it included have changed since, and its
+    output, along with its precompressed copies if options asked for them,
+    still exists.
+    """
+    entry = self.entries.get(self.get_key(filepath))
+    if entry is None or entry['options'] != options:
+      return False
+    output = os.path.join(self.base_path, entry['output'])
+    try:
+      output_size = os.path.getsize(output)
+    except OSError:
+      return False
+    if options.get('precompress'):
+      from wieldymarkup.build import get_precompressors, precompress_threshold
+      if output_size >= precompress_threshold:
+        for extension, compress in get_precompressors():
+          if not os.path.exists(output + extension):
+            return False
+    if not self.is_unchanged(filepath, entry):
+      return False
+    for key, record in entry.get('includes', {}).items():
+      if not self.is_unchanged(self.get_path(key), record):
+        return False
+    return True
+  
+  def is_unchanged(self, filepath, record):
+    """
+    Returns whether filepath still has the mtime, size and digest in
+    record. The content is only hashed when the mtime differs but the size
+    does not.
+    """
+    try:
+      stat = os.stat(filepath)
+    except OSError:
+      return False
+    if stat.st_size != record['size']:
+      return False
+    if stat.st_mtime_ns == record['mtime']:
+      return True
+    
+    # Touched but possibly unchanged, e.g. by a fresh checkout
+    if get_file_digest(filepath) != record['digest']:
+      return False
+    record['mtime'] = stat.st_mtime_ns
+    self.changed = True
+    return True
+  
+  def update(self, filepath, output, options, signature, includes=None):
+    """
+    Records that filepath, whose (mtime_ns, size, digest) before compiling
+    was signature, was built into output with options. includes maps the
+    path of each partial it included to the (mtime_ns, size, digest) of
+    the content that was compiled, as taken when the partial was read.
+    """
+    mtime, size, digest = signature
+    include_records = {}
+    for include, (include_mtime, include_size, include_digest) in (includes or {}).items():
+      include_records[self.get_key(include)] = {
+        'mtime': include_mtime,
+        'size': include_size,
+        'digest': include_digest,
+      }
+    
+    self.entries[self.get_key(filepath)] = {
+      'mtime': mtime,
+      'size': size,
+      'digest': digest,
+      'options': options,
+      'output': self.get_key(output),
+      'includes': include_records,
+    }
+    self.dependents = None
+    self.changed = True
+    return self
+  
+  def get_output(self, filepath):
+    """
+    Returns the path of the output filepath was last built into, or None
+    if it has not been built.
+    """
+    entry = self.entries.get(self.get_key(filepath))
+    return None if entry is None else self.get_path(entry['output'])
+  
+  def discard(self, filepath):
+    if self.entries.pop(self.get_key(filepath), None) is not None:
+      self.dependents = None
+      self.changed = True
+    return self
+  
+  def get_dependents(self, filepath):
+    """
+    Returns the sorted paths of the sources that included filepath,
+    directly or not, when they were last built.
+    """
+    if self.dependents is None:
+      self.dependents = {}
+      for key, entry in self.entries.items():
+        for include_key in entry.get('includes', {}):
+          self.dependents.setdefault(include_key, []).append(key)
+    return sorted(self.get_path(key) for key in self.dependents.get(self.get_key(filepath), []))
@@ -0,0 +1,92 @@
+"""
+Sends compile requests to a running wieldymarkup server (see
+wieldymarkup.server). Run it with
+
+  python /path/to/wieldymarkup client --socket PATH FILE...
+
+It imports nothing of the compiler, so each call costs little more than
+interpreter startup and a local round trip.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import sys, os, json, socket, argparse
+
+class Client(object):
+  """
+  A connection to a CompileServer that sends any number of requests, one
+  at a time.
+  """
+  
+  def __init__(self, socket_path, timeout=None):
+    self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.socket.settimeout(timeout)
+    self.socket.connect(socket_path)
+    self.rfile = self.socket.makefile('rb')
+  
+  def request(self, **request):
+    """
+    Sends a request with the given fields and returns the reply as a dict.
+    """
+    self.socket.sendall(json.dumps(request).encode('utf-8') + b"\n")
+    line = self.rfile.readline()
+    if not line:
+      raise Exception("The server closed the connection.")
+    return json.loads(line.decode('utf-8'))
+  
+  def close(self):
+    self.rfile.close()
+    self.socket.close()
+  
+  def __enter__(self):
+    return self
+  
+  def __exit__(self, *exc_info):
+    self.close()
+
+def get_argument_parser():
+  parser = argparse.ArgumentParser(prog="wieldymarkup client",
+    description="Compile .wml files through a running wieldymarkup server. "
+      "Use - as FILE to compile standard input to standard output.")
+  parser.add_argument("files", nargs="+", metavar="FILE",
+    help="a .wml file to compile")
+  parser.add_argument("-c", "--compress", action="store_true",
+    help="remove whitespace between HTML tags")
+  parser.add_argument("-m", "--minify", action="store_true",
+    help="like -c, and also collapse whitespace in text and drop optional quotes and end tags")
+  parser.add_argument("-z", "--precompress", action="store_true",
+    help="also write .html.gz, and .html.br if the brotli module is installed, for outputs of 1 KB or more")
+  parser.add_argument("-f", "--force", action="store_true",
+    help="skip files without the .wml extension instead of failing")
+  parser.add_argument("--socket", required=True, metavar="PATH",
+    help="path of the Unix domain socket")
+  return parser
+
+def run_client(args, stdin=None, stdout=None, stderr=None):
+  stdin = sys.stdin if stdin is None else stdin
+  stdout = sys.stdout if stdout is None else stdout
+  stderr = sys.stderr if stderr is None else stderr
+  options = {'compress': args.compress, 'minify': args.minify}
+  
+  failed = 0
+  with Client(args.socket) as client:
+    for filepath in args.files:
+      if filepath == "-":
+        reply = client.request(text=stdin.read(), **options)
+      else:
+        reply = client.request(path=os.path.abspath(filepath), strict=not args.force,
+          precompress=args.precompress, **options)
+      
+      if 'error' in reply:
+        stderr.write(filepath + ": " + reply['error'] + "\n")
+        failed += 1
+      elif 'html' in reply:
+        stdout.write(reply['html'])
+  return 1 if failed else 0
+
+def main(argv):
+  """
+  Runs the client command with argv, the arguments that follow it.
+  """
+  return run_client(get_argument_parser().parse_args(argv))
@@ -1,8 +1,195 @@
 # -*- coding: utf-8 -*-
-import string, copy, re
+import os, string, copy, re, io, mmap, codecs, hashlib, functools, time, threading
+
+from wieldymarkup.tree import Document, Element, Embedded, copy_nodes, write_nodes
+from wieldymarkup.minify import render_minified
+
+leading_whitespace_pattern = re.compile(r"[ \t]*")
+
+# Matches a selector, which runs to the first whitespace character
+selector_pattern = re.compile(r"[^" + re.escape(string.whitespace) + "]*")
+
+# Matches an unquoted attribute value up to and including its last
+# whitespace character before the next '='
+attribute_value_pattern = re.compile(r"[^=]*[" + re.escape(string.whitespace) + "]")
+
+# Matches a line that includes a partial, e.g. "include shared/nav.wml"
+include_pattern = re.compile(r"include\s+(\S+\.wml)$")
+
+# Number of distinct selectors and attribute strings to keep parsed
+selector_cache_size = 1024
+attribute_cache_size = 4096
+
+# Attribute strings longer than this are parsed without the cache
+attribute_cache_max_length = 512
+
+# Parsed partials by absolute path, as (dependencies, document), where
+# dependencies maps the partial and every file it includes to the
+# (mtime_ns, size, digest) of the content that was parsed
+partial_cache = {}
+partial_cache_size = 256
+# Held while partial_cache is resized, as compilers in other threads share it
+partial_cache_lock = threading.Lock()
 
 class CompilerException(Exception):
-  pass
+  """
+  An error in the source. line_number is the line it was found on, or None
+  if it is not known.
+  """
+  
+  def __init__(self, message, line_number=None):
+    Exception.__init__(self, message)
+    self.line_number = line_number
+  
+  def __reduce__(self):
+    # Keep line_number when the exception is pickled, e.g. by a process pool
+    return self.__class__, (str(self), self.line_number)
+
+class UnterminatedTextException(CompilerException):
+  """
+  The source ended inside a multi-line inner text, before the '>' that
+  closes it. Raised as soon as the end is reached, so a caller compiling a
+  document in pieces can go on with the next piece.
+  """
+
+class OutputBuffer(object):
+  """
+  Collects output fragments and joins them only when the output is read.
+  """
+  
+  def __init__(self):
+    self.fragments = []
+  
+  def write(self, fragment):
+    self.fragments.append(fragment)
+  
+  def getvalue(self):
+    if len(self.fragments) > 1:
+      self.fragments = [''.join(self.fragments)]
+    return self.fragments[0] if self.fragments else ""
+  
+  def drain(self):
+    value = self.getvalue()
+    self.fragments = []
+    return value
+  
+  def flush(self):
+    pass
+
+def is_binary_stream(stream):
+  """
+  Returns whether stream takes bytes rather than text: binary io streams
+  do, as do other file-like objects opened with a 'b' mode, except codecs
+  writers, which encode the text they are given.
+  """
+  if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)):
+    return True
+  if isinstance(stream, (io.TextIOBase, codecs.StreamWriter, codecs.StreamReaderWriter)):
+    return False
+  mode = getattr(stream, 'mode', None)
+  return isinstance(mode, str) and 'b' in mode
+
+class StreamOutput(object):
+  """
+  Collects output fragments and writes them to a text or binary stream in
+  blocks of roughly buffer_size characters. Binary streams receive the
+  output encoded with encoding.
+  """
+  
+  def __init__(self, stream, encoding="utf-8", buffer_size=65536):
+    self.stream = stream
+    self.encoding = encoding
+    self.buffer_size = buffer_size
+    self.binary = is_binary_stream(stream)
+    self.fragments = []
+    self.size = 0
+  
+  def write(self, fragment):
+    self.fragments.append(fragment)
+    self.size += len(fragment)
+    if self.size >= self.buffer_size:
+      self.flush()
+  
+  def getvalue(self):
+    return ""
+  
+  def flush(self):
+    if len(self.fragments) > 0:
+      data = ''.join(self.fragments)
+      self.fragments = []
+      self.size = 0
+      if self.binary:
+        data = data.encode(self.encoding)
+      self.stream.write(data)
+
+class CompilerStats(object):
+  """
+  Time spent in and calls made to each phase of a compile, with the number
+  of lines, tags, bytes in and bytes out. Phase times exclude the time of
+  nested phases, e.g. close_lower_level_tags excludes the output it emits.
+  """
+  
+  phases = (
+    'process_current_level',
+    'close_lower_level_tags',
+    'process_selector',
+    'process_attributes',
+    'process_inner_text',
+    'output',
+  )
+  
+  def __init__(self):
+    self.times = dict((phase, 0.0) for phase in self.phases)
+    self.calls = dict((phase, 0) for phase in self.phases)
+    self.lines = 0
+    self.tags = 0
+    self.bytes_in = 0
+    self.bytes_out = 0
+    # Time of the phases nested in the one running now
+    self.nested_time = 0.0
+  
+  def add(self, other):
+    for phase in self.phases:
+      self.times[phase] += other.times[phase]
+      self.calls[phase] += other.calls[phase]
+    self.lines += other.lines
+    self.tags += other.tags
+    self.bytes_in += other.bytes_in
+    self.bytes_out += other.bytes_out
+    return self
+  
+  def as_dict(self):
+    return {
+      'times': dict(self.times),
+      'calls': dict(self.calls),
+      'lines': self.lines,
+      'tags': self.tags,
+      'bytes_in': self.bytes_in,
+      'bytes_out': self.bytes_out,
+    }
+
+class CountingOutput(object):
+  """
+  Wraps a sink and adds the UTF-8 size of everything written to
+  stats.bytes_out.
+  """
+  
+  def __init__(self, sink, stats):
+    self.sink = sink
+    self.stats = stats
+  
+  def write(self, fragment):
+    self.stats.bytes_out += len(fragment.encode('utf-8'))
+    self.sink.write(fragment)
+  
+  def getvalue(self):
+    return self.sink.getvalue()
+  
+  def drain(self):
+    return self.sink.drain()
+  
+  def flush(self):
+    self.sink.flush()
 
 class Compiler(object):
   """
@@ -10,6 +197,36 @@ class Compiler(object):
   
   embedding_token = '`'
   
+  # Methods timed when profiling, and the phase each one counts towards
+  profiled_methods = {
+    'process_current_level': 'process_current_level',
+    'close_lower_level_tags': 'close_lower_level_tags',
+    'process_selector': 'process_selector',
+    'process_attributes': 'process_attributes',
+    'process_inner_text': 'process_inner_text',
+    'close_tag': 'output',
+    'process_embedded_line': 'output',
+    'add_html_to_output': 'output',
+    'process_include': 'output',
+  }
+  
+  # The 'reference' engine compiles with the methods below, one line at a
+  # time. The 'fast' engine compiles text held in memory in one loop, and
+  # must give the same output and errors.
+  engines = ('reference', 'fast')
+  engine = 'reference'
+  
+  profile = False
+  stats = None
+  
+  # Set while validating: the source is parsed and checked, but neither
+  # output nor a document is built
+  checking = False
+  
+  # Absolute paths of the partials being parsed by the compilers that
+  # started this one, to catch circular includes
+  include_stack = ()
+  
   @staticmethod
   def remove_grouped_text(text, z):
     output = ""
@@ -34,53 +251,16 @@ class Compiler(object):
   
   @staticmethod
   def get_selector_from_line(line):
-    first_whitespace_index = None
-    for i, char in enumerate(line):
-      if char in string.whitespace:
-        first_whitespace_index = i
-        break
-    if first_whitespace_index is None:
-      return line
-    else:
-      return line[:first_whitespace_index]
+    return selector_pattern.match(line).group()
   
   @staticmethod
   def get_tag_nest_level(text, open_string='<', close_string='>'):
-    text = copy.copy(text)
-    nest_level = 0
-    while True:
-      open_string_index = text.index(open_string) if open_string in text else None
-      close_string_index = text.index(close_string) if close_string in text else None
-      open_string_first = False
-      close_string_first = False
-      
-      # Only same if both None
-      if open_string_index is close_string_index:
-        break
-      elif open_string_index is not None:
-        open_string_first = True
-      elif close_string_index is not None:
-        close_string_first = True
-      else:
-        if open_string_index < close_string_index:
-          open_string_first = True
-        else:
-          close_string_first = True
-      
-      if open_string_first:
-        nest_level += 1
-        if len(text) is open_string_index+len(open_string):
-          break
-        else:
-          text = text[open_string_index+len(open_string):]
-      elif close_string_first:
-        nest_level -= 1
-        if len(text) is close_string_index+len(close_string):
-          break
-        else:
-          text = text[close_string_index+len(close_string):]
-    
-    return nest_level
+    # Every open_string counts, but only close_strings after the last
+    # open_string are subtracted.
+    last_open_index = text.rfind(open_string)
+    if last_open_index == -1:
+      return -text.count(close_string)
+    return text.count(open_string) - text.count(close_string, last_open_index + len(open_string))
   
   @staticmethod
   def get_leading_whitespace_from_text(text):
@@ -91,31 +271,433 @@ class Compiler(object):
         break
     return leading_whitespace
   
-  def __init__(self, text="", compress=False):
-    self.compile(text, compress)
+  def __init__(self, text="", compress=False, profile=False, minify=False, engine='reference'):
+    if engine not in self.engines:
+      raise ValueError("engine must be 'reference' or 'fast', not " + repr(engine))
+    self.engine = engine
+    if profile:
+      self.enable_profiling()
+    self.compile(text, compress, minify=minify)
+  
+  def enable_profiling(self):
+    """
+    Times every compile from now on, in a new CompilerStats on self.stats.
+    The timed methods are wrapped on this instance only, so compilers that
+    are not profiled run the class's methods untouched.
+    """
+    if self.profile:
+      return self
+    self.profile = True
+    for name, phase in self.profiled_methods.items():
+      setattr(self, name, self.get_timed_method(getattr(self, name), phase))
+    return self
+  
+  def get_timed_method(self, method, phase):
+    timer = time.perf_counter
+    def timed_method(*args, **kwargs):
+      stats = self.stats
+      stats.calls[phase] += 1
+      outer_nested_time = stats.nested_time
+      stats.nested_time = 0.0
+      start = timer()
+      try:
+        return method(*args, **kwargs)
+      finally:
+        elapsed = timer() - start
+        stats.times[phase] += elapsed - stats.nested_time
+        stats.nested_time = outer_nested_time + elapsed
+    return timed_method
+  
+  @property
+  def output(self):
+    return self.sink.getvalue()
+  
+  @output.setter
+  def output(self, value):
+    self.sink = OutputBuffer()
+    if value:
+      self.sink.write(value)
+  
+  def compile(self, text="", compress=False, source_path=None, minify=False):
+    """
+    Compiles text and keeps the output on the compiler. minify goes further
+    than compress: it also collapses whitespace in text and embedded HTML
+    and drops optional attribute quotes and end tags, but needs the whole
+    document parsed before any of it is output.
+    """
+    if minify:
+      html = render_minified(self.parse(text, source_path))
+      self.output = html
+      if self.profile:
+        # The output setter does not go through the counting sink
+        self.stats.bytes_out += len(html.encode('utf-8'))
+      return self
+    self.reset(text, compress, source_path=source_path)
+    return self.process_text()
+  
+  def parse(self, text="", source_path=None):
+    """
+    Parses text into a wieldymarkup.tree.Document instead of compiling it,
+    so that it can be rendered several times, or pickled, without being
+    parsed again. Included partials are copied into the document.
+    """
+    self.reset(text, source_path=source_path)
+    self.document = Document()
+    self.open_nodes = []
+    try:
+      self.process_text()
+      self.document.indent_token = self.indent_token
+      return self.document
+    finally:
+      self.document = None
+      self.open_nodes = []
+  
+  def validate(self, text="", source_path=None):
+    """
+    Checks text without building any output, and returns a list with a
+    CompilerException for every error found, in line order, instead of
+    stopping at the first one. Besides the errors compile raises, lines
+    whose indentation is not a whole number of indent tokens are reported.
+    """
+    self.reset(text, source_path=source_path)
+    self.errors = []
+    self.checking = True
+    try:
+      while self.has_more_text():
+        try:
+          self.process_current_level().close_lower_level_tags().process_next_line()
+        except CompilerException as e:
+          # The line was read, so checking resumes at the next one
+          self.errors.append(e)
+      self.finish()
+      return self.errors
+    finally:
+      self.checking = False
+      self.text = ""
+      self.position = 0
+  
+  def compile_to(self, stream, text="", compress=False, encoding="utf-8", source_path=None):
+    """
+    Compiles text and writes the output to stream, which may be any
+    writable text or binary file-like object (a file, a socket's makefile(),
+    a gzip writer). The output is not kept on the compiler.
+    """
+    self.reset(text, compress, StreamOutput(stream, encoding), source_path=source_path)
+    try:
+      self.process_text()
+      self.sink.flush()
+    finally:
+      self.sink = OutputBuffer()
+    return self
+  
+  def compile_path(self, filepath, stream=None, compress=False, encoding="utf-8"):
+    """
+    Compiles the UTF-8 file at filepath by mapping it into memory, so the
+    source is never held as one string: line breaks are found in the
+    mapping and only the lines being processed are decoded. The output is
+    written to stream, as with compile_to, or kept on the compiler if
+    stream is None.
+    """
+    with open(filepath, 'rb') as f:
+      # Empty files cannot be mapped
+      if os.fstat(f.fileno()).st_size == 0:
+        mapping = None
+        lines = iter(())
+      else:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        lines = iter_mapped_lines(mapping)
+    
+    self.reset(compress=compress, sink=None if stream is None else StreamOutput(stream, encoding), source=lines,
+      source_path=filepath)
+    try:
+      self.process_text()
+      self.sink.flush()
+    finally:
+      self.source = None
+      if mapping is not None:
+        lines.close()
+        mapping.close()
+      if stream is not None:
+        self.sink = OutputBuffer()
+    return self
   
-  def compile(self, text="", compress=False):
+  def reset(self, text="", compress=False, sink=None, source=None, source_path=None):
+    """
+    Prepares to compile text, or the lines of source. Included partials
+    are found relative to the directory of source_path, or to the current
+    directory if it is None.
+    """
     self.text = str(text)
     self.compress = not not compress
-    self.output = ""
+    self.sink = OutputBuffer() if sink is None else sink
+    if self.profile:
+      self.stats = CompilerStats()
+      self.stats.bytes_in = len(self.text.encode('utf-8'))
+      self.sink = CountingOutput(self.sink, self.stats)
     self.open_tags = []
     self.indent_token = ""
     self.current_level = 0
     self.previous_level = None
     self.text = text
+    self.position = 0
+    self.source = None if source is None else iter(source)
     self.line_number = 0
+    self.document = None
+    self.source_path = source_path
+    # Every file included so far, directly or not, with the (mtime_ns, size,
+    # digest) of the content parsed
+    self.includes = {}
+    return self
+  
+  def process_text(self):
+    # self.text is never sliced; self.position marks the start of the next
+    # unread line, so each character is scanned a constant number of times.
+    if self.engine == 'fast' and self.source is None and self.document is None and not self.profile:
+      self.process_text_fast()
+    else:
+      while self.has_more_text():
+        self.process_current_level().close_lower_level_tags().process_next_line()
     
-    while self.text != "":
-      self.process_current_level().close_lower_level_tags().process_next_line()
-      
+    self.finish()
+    self.text = ""
+    self.position = 0
+    
+    return self
+  
+  def process_text_fast(self):
+    """
+    The 'fast' engine's loop over the lines of self.text. It does what
+    process_current_level, close_lower_level_tags and process_next_line do
+    for each line, inlined and with the state in local variables, and
+    leaves the tags still open to finish.
+    """
+    text = self.text
+    size = len(text)
+    position = self.position
+    compress = self.compress
+    indent_token = self.indent_token
+    current_level = self.current_level
+    line_number = self.line_number
+    open_tags = self.open_tags
+    write = self.sink.write
+    parse_selector = self.__class__.parse_selector
+    get_attributes = self.__class__.get_attributes
+    embedding_token = self.__class__.embedding_token
+    match_whitespace = leading_whitespace_pattern.match
+    match_selector = selector_pattern.match
+    
+    try:
+      while position < size:
+        previous_level = current_level
+        whitespace_end = match_whitespace(text, position).end()
+        # Whitespace running to the end of the text does not count as indentation
+        if whitespace_end == position or whitespace_end == size:
+          current_level = 0
+        elif indent_token == "":
+          indent_token = text[position:whitespace_end]
+          current_level = 1
+        else:
+          current_level = 0
+          start = position
+          token_length = len(indent_token)
+          while text.startswith(indent_token, start, whitespace_end):
+            current_level += 1
+            start += token_length
+        
+        if current_level <= previous_level:
+          while len(open_tags) > 0 and open_tags[-1][0] >= current_level:
+            level, tag = open_tags.pop()
+            if compress:
+              write("</" + tag + ">")
+            else:
+              write(level * indent_token + "</" + tag + ">\n")
+        
+        line_break_index = text.find("\n", position)
+        if line_break_index == -1:
+          line = text[position:].strip()
+          position = size
+        else:
+          line = text[position:line_break_index].strip()
+          position = line_break_index + 1
+        
+        line_number += 1
+        if len(line) == 0:
+          continue
+        
+        if line[0] == embedding_token:
+          if compress:
+            write(line[1:])
+          else:
+            write(current_level * indent_token + line[1:] + "\n")
+          continue
+        
+        if line.startswith('include'):
+          match = include_pattern.match(line)
+          if match is not None:
+            self.position = position
+            self.indent_token = indent_token
+            self.current_level = current_level
+            self.line_number = line_number
+            self.process_include(match.group(1))
+            indent_token = self.indent_token
+            continue
+        
+        # Each segment before the last "\-\" opens a tag one level deeper
+        segments = line.split('\\-\\')
+        last_index = len(segments) - 1
+        for index, segment in enumerate(segments):
+          segment = segment.strip()
+          selector = match_selector(segment).group()
+          rest_of_line = segment[len(selector):].strip()
+          if '=' in rest_of_line:
+            tag_attributes, rest_of_line, unmatched = get_attributes(rest_of_line)
+            if unmatched is not None:
+              raise CompilerException("Unmatched '" + unmatched + "' found in line " + str(line_number),
+                line_number)
+          else:
+            tag_attributes = ()
+          
+          inner_text = None
+          self_closing = False
+          if index == last_index:
+            if rest_of_line.startswith('<'):
+              # As in process_inner_text
+              pieces = [rest_of_line]
+              last_open_index = rest_of_line.rfind('<')
+              open_count = rest_of_line.count('<')
+              trailing_close_count = rest_of_line.count('>', last_open_index + 1)
+              if open_count - trailing_close_count < 0:
+                raise CompilerException("Too many '>' found on line " + str(line_number), line_number)
+              
+              start_line_number = line_number
+              while open_count - trailing_close_count > 0:
+                if position >= size:
+                  raise UnterminatedTextException("Unmatched '<' found on line " + str(start_line_number),
+                    start_line_number)
+                line_number += 1
+                line_break_index = text.find("\n", position)
+                if line_break_index == -1:
+                  # A final line without a line break is appended as is
+                  next_line = text[position:]
+                  position = size
+                  pieces.append(next_line)
+                else:
+                  next_line = text[position:line_break_index].strip()
+                  position = line_break_index + 1
+                  pieces.append(' ')
+                  pieces.append(next_line)
+                
+                last_open_index = next_line.rfind('<')
+                if last_open_index == -1:
+                  trailing_close_count += next_line.count('>')
+                else:
+                  open_count += next_line.count('<')
+                  trailing_close_count = next_line.count('>', last_open_index + 1)
+              
+              inner_text = ''.join(pieces).strip()[1:-1]
+            
+            elif rest_of_line.startswith('/'):
+              self_closing = rest_of_line[-1] == '/'
+          
+          tag, tag_id, tag_classes = parse_selector(selector)
+          html = "<" + tag
+          if tag_id is not None:
+            html += ' id="' + tag_id + '"'
+          if len(tag_classes) > 0:
+            html += ' class="' + ' '.join(tag_classes) + '"'
+          if len(tag_attributes) > 0:
+            html += ''.join(tag_attributes)
+          
+          if self_closing:
+            html += ' />'
+          elif inner_text is None:
+            html += '>'
+            open_tags.append((current_level, tag))
+          else:
+            html += '>' + inner_text + "</" + tag + ">"
+          
+          if compress:
+            write(html)
+          else:
+            write(current_level * indent_token + html + "\n")
+          
+          if index < last_index:
+            current_level += 1
+    
+    finally:
+      self.position = position
+      self.indent_token = indent_token
+      self.current_level = current_level
+      self.line_number = line_number
+    
+    return self
+  
+  def finish(self):
     while len(self.open_tags) > 0:
       self.close_tag()
     
+    if self.profile:
+      self.stats.lines = self.line_number
+      self.stats.tags = self.stats.calls['process_selector']
     return self
   
+  def has_more_text(self):
+    return self.position < len(self.text) or self.fill_buffer()
+  
+  def fill_buffer(self):
+    """
+    Pulls chunks from the source until the text holds a complete line past
+    the position or the source is exhausted. Only the unread remainder of
+    the previous text is kept. Returns whether any unread text is left.
+    """
+    if self.source is None:
+      return self.position < len(self.text)
+    
+    pieces = [self.text[self.position:]]
+    for chunk in self.source:
+      if self.profile:
+        self.stats.bytes_in += len(chunk.encode('utf-8'))
+      pieces.append(chunk)
+      if "\n" in chunk:
+        break
+    else:
+      self.source = None
+    
+    self.text = ''.join(pieces)
+    self.position = 0
+    return len(self.text) > 0
+  
+  def ensure_line(self):
+    if self.source is not None and self.text.find("\n", self.position) == -1:
+      self.fill_buffer()
+  
+  def read_line(self):
+    """
+    Returns the next raw line (without its line break) and moves the
+    position past it, or returns None if the text is exhausted.
+    """
+    self.ensure_line()
+    if self.position >= len(self.text):
+      return None
+    line_break_index = self.text.find("\n", self.position)
+    if line_break_index == -1:
+      line = self.text[self.position:]
+      self.position = len(self.text)
+    else:
+      line = self.text[self.position:line_break_index]
+      self.position = line_break_index + 1
+    return line
+  
   def process_current_level(self):
     self.previous_level = self.current_level
-    leading_whitespace = self.__class__.get_leading_whitespace_from_text(self.text)
+    self.ensure_line()
+    match = leading_whitespace_pattern.match(self.text, self.position)
+    # Whitespace running to the end of the text does not count as indentation
+    if match.end() == len(self.text):
+      leading_whitespace = ""
+    else:
+      leading_whitespace = match.group()
+    
     if leading_whitespace == "":
       self.current_level = 0
     
@@ -127,10 +709,19 @@ class Compiler(object):
     # Else, set current_level to number of repetitions of index_token in leading_whitespace
     else:
       i = 0
-      while leading_whitespace.startswith(self.indent_token):
+      start = 0
+      token_length = len(self.indent_token)
+      while leading_whitespace.startswith(self.indent_token, start):
         i += 1
-        leading_whitespace = leading_whitespace[len(self.indent_token):]
+        start += token_length
       self.current_level = i
+      
+      # Lines holding only whitespace are not checked
+      if self.checking and start < len(leading_whitespace) and \
+          self.text[self.position + len(leading_whitespace)] not in "\r\n":
+        line_number = self.line_number + 1
+        self.errors.append(CompilerException("Inconsistent indentation found on line " + str(line_number),
+          line_number))
     
     return self
   
@@ -144,11 +735,16 @@ class Compiler(object):
   
   def close_tag(self):
     closing_tag_tuple = self.open_tags.pop()
-    if not self.compress:
-      self.output += closing_tag_tuple[0] * self.indent_token
-    self.output += "</" + closing_tag_tuple[1] + ">"
-    if not self.compress:
-      self.output += "\n"
+    if self.checking:
+      pass
+    elif self.document is not None:
+      self.open_nodes.pop()
+      if self.indent_token == "":
+        self.document.unindented_count += 1
+    elif self.compress:
+      self.sink.write("</" + closing_tag_tuple[1] + ">")
+    else:
+      self.sink.write(closing_tag_tuple[0] * self.indent_token + "</" + closing_tag_tuple[1] + ">\n")
     return self
   
   def process_next_line(self):
@@ -156,71 +752,45 @@ class Compiler(object):
     self.self_closing = False
     self.inner_text = None
     
-    line = ""
-    
-    if "\n" in self.text:
-      line_break_index = self.text.index("\n")
-      line = self.text[:line_break_index].strip()
-      self.text = self.text[line_break_index+1:]
-    else:
-      line = self.text.strip()
-      self.text = ""
+    line = self.read_line()
+    if line is None:
+      return self
+    line = line.strip()
     
     self.line_number += 1
-    if len(line) is 0:
+    if len(line) == 0:
       return self
     
     # Whole line embedded HTML, starting with back ticks:
     if line[0] == self.__class__.embedding_token:
       self.process_embedded_line(line)
     
+    elif line.startswith('include') and include_pattern.match(line):
+      self.process_include(include_pattern.match(line).group(1))
+    
     else:
-      # Support multiple tags on one line via "\-\" delimiter
-      line_split_list = line.split('\\-\\')
-      while len(line_split_list) > 1:
-        temp_line = line_split_list.pop(0).strip()
-        selector = self.__class__.get_selector_from_line(temp_line)
-        self.process_selector(copy.copy(selector))
-        rest_of_line = temp_line[len(selector):].strip()
-        rest_of_line = self.process_attributes(rest_of_line)
+      # Support multiple tags on one line via "\-\" delimiter. Each segment
+      # before the last opens a tag one level deeper; the segments are
+      # visited by index, so a long chain costs linear time.
+      segments = line.split('\\-\\')
+      last_index = len(segments) - 1
+      for index in range(last_index):
+        segment = segments[index].strip()
+        selector = self.__class__.get_selector_from_line(segment)
+        self.process_selector(selector)
+        self.process_attributes(segment[len(selector):].strip())
         self.add_html_to_output()
-        
-        self.tag = None
-        self.tag_id = None
-        self.tag_classes = []
-        self.tag_attributes = []
         self.previous_level = self.current_level
         self.current_level += 1
       
-      line = line_split_list[len(line_split_list) - 1].strip()
+      line = segments[last_index].strip()
       selector = self.__class__.get_selector_from_line(line)
-      self.process_selector(copy.copy(selector))
+      self.process_selector(selector)
       rest_of_line = line[len(selector):].strip()
       rest_of_line = self.process_attributes(rest_of_line)
       
       if rest_of_line.startswith('<'):
-        self.inner_text = rest_of_line
-        if self.__class__.get_tag_nest_level(self.inner_text) < 0:
-          raise CompilerException("Too many '>' found on line " + str(self.line_number))
-        
-        while self.__class__.get_tag_nest_level(self.inner_text) > 0:
-          if self.text == "":
-            raise CompilerException("Unmatched '<' found on line " + str(self.line_number))
-          
-          elif "\n" in self.text:
-            line_break_index = self.text.index("\n")
-            # Guarantee only one space between text between lines.
-            self.inner_text += ' ' + self.text[:line_break_index].strip()
-            if len(self.text) == line_break_index + 1:
-              self.text = ""
-            else:
-              self.text = self.text[line_break_index+1:]
-          
-          else:
-            self.inner_text += self.text
-            self.text = ""
-        
-        self.inner_text = self.inner_text.strip()[1:-1]
+        self.process_inner_text(rest_of_line)
       
       elif rest_of_line.startswith('/'):
         if len(rest_of_line) > 0 and rest_of_line[-1] == '/':
@@ -230,19 +800,170 @@ class Compiler(object):
     
     return self
   
+  def process_inner_text(self, rest_of_line):
+    """
+    Sets inner_text from rest_of_line, pulling in continuation lines until
+    its '<' and '>' are balanced. The nest level is kept as a running count
+    (the same one get_tag_nest_level computes) so each line is scanned once.
+    """
+    pieces = [rest_of_line]
+    last_open_index = rest_of_line.rfind('<')
+    open_count = rest_of_line.count('<')
+    # Closing brackets after the last opening one
+    trailing_close_count = rest_of_line.count('>', last_open_index + 1)
+    
+    if open_count - trailing_close_count < 0:
+      raise CompilerException("Too many '>' found on line " + str(self.line_number), self.line_number)
+    
+    line_number = self.line_number
+    while open_count - trailing_close_count > 0:
+      if not self.has_more_text():
+        raise UnterminatedTextException("Unmatched '<' found on line " + str(line_number), line_number)
+      
+      next_line = self.read_line()
+      self.line_number += 1
+      # A final line without a line break is appended as is
+      if self.text[self.position-1] != "\n":
+        pieces.append(next_line)
+      else:
+        # Guarantee only one space between text between lines.
+        next_line = next_line.strip()
+        pieces.append(' ')
+        pieces.append(next_line)
+      
+      last_open_index = next_line.rfind('<')
+      if last_open_index == -1:
+        trailing_close_count += next_line.count('>')
+      else:
+        open_count += next_line.count('<')
+        trailing_close_count = next_line.count('>', last_open_index + 1)
+    
+    self.inner_text = ''.join(pieces).strip()[1:-1]
+    return self
+  
   def process_embedded_line(self, line):
     self.line_starts_with_tick = True
-    if not self.compress:
-      self.output += self.current_level * self.indent_token
-    self.output += line[1:]
-    if not self.compress:
-      self.output += "\n"
+    if self.checking:
+      pass
+    elif self.document is not None:
+      self.add_node(Embedded(line[1:], self.current_level))
+    elif self.compress:
+      self.sink.write(line[1:])
+    else:
+      self.sink.write(self.current_level * self.indent_token + line[1:] + "\n")
     return self
   
-  def process_selector(self, selector):
+  def process_include(self, path):
+    """
+    Expands the partial at path at the current level, as if its lines had
+    been pasted here. If no indentation has been seen yet, the partial's
+    indentation becomes this compiler's.
+    """
+    document = self.get_partial(path)
+    
+    unindented_count = 0
+    if self.indent_token == "" and document.indent_token != "":
+      unindented_count = document.unindented_count
+      self.indent_token = document.indent_token
+    
+    if self.checking:
+      pass
+    
+    elif self.document is not None:
+      nodes = copy_nodes(document.children, self.current_level)
+      if self.indent_token == "":
+        fragments = []
+        write_nodes(fragments, nodes, "", "")
+        unindented_count = len(fragments)
+      self.document.unindented_count += unindented_count
+      if len(self.open_nodes) > 0:
+        self.open_nodes[-1].children.extend(nodes)
+      else:
+        self.document.children.extend(nodes)
+    
+    else:
+      fragments = []
+      if self.compress:
+        write_nodes(fragments, document.children, "", "")
+      else:
+        write_nodes(fragments, document.children, self.indent_token, "\n", unindented_count, self.current_level)
+      self.sink.write(''.join(fragments))
+    
+    return self
+  
+  def get_partial(self, path):
+    """
+    Returns the parsed Document of the partial at path, relative to the
+    directory of source_path, parsing it only if it or one of its own
+    includes changed since it was last parsed.
+    """
+    if self.source_path is None:
+      filepath = os.path.abspath(path)
+    else:
+      filepath = os.path.join(os.path.dirname(os.path.abspath(self.source_path)), path)
+    filepath = os.path.normpath(filepath)
+    
+    include_stack = self.include_stack
+    if self.source_path is not None:
+      include_stack += (os.path.abspath(self.source_path),)
+    if filepath in include_stack:
+      raise CompilerException("Circular include of '" + path + "' found on line " + str(self.line_number),
+        self.line_number)
+    
+    entry = partial_cache.get(filepath)
+    if entry is None or not self.__class__.is_partial_current(entry[0]):
+      try:
+        with open(filepath, 'rb') as f:
+          mtime = os.fstat(f.fileno()).st_mtime_ns
+          data = f.read()
+        text = data.decode('utf-8')
+      except (IOError, OSError) as e:
+        raise CompilerException("Could not include '" + path + "' on line " + str(self.line_number) + ": " + str(e.strerror),
+          self.line_number)
+      
+      compiler = self.__class__()
+      compiler.include_stack = include_stack
+      try:
+        document = compiler.parse(text, source_path=filepath)
+      except CompilerException as e:
+        raise CompilerException(str(e) + " in '" + path + "', included on line " + str(self.line_number),
+          self.line_number)
+      
+      # The signature of the content read, so a later edit is never taken
+      # for the version this was parsed from
+      dependencies = {filepath: (mtime, len(data), hashlib.sha1(data).hexdigest())}
+      dependencies.update(compiler.includes)
+      entry = (dependencies, document)
+      with partial_cache_lock:
+        if len(partial_cache) >= partial_cache_size:
+          # Forget the oldest partial
+          partial_cache.pop(next(iter(partial_cache), None), None)
+        partial_cache[filepath] = entry
+    
+    self.includes.update(entry[0])
+    return entry[1]
+  
+  @staticmethod
+  def is_partial_current(dependencies):
+    for filepath, signature in dependencies.items():
+      try:
+        stat = os.stat(filepath)
+      except OSError:
+        return False
+      if (stat.st_mtime_ns, stat.st_size) != signature[:2]:
+        return False
+    return True
+  
+  @staticmethod
+  @functools.lru_cache(maxsize=selector_cache_size)
+  def parse_selector(selector):
+    """
+    Returns (tag, tag_id, tag_classes) for selector. Results are kept in a
+    bounded LRU cache, as templates repeat the same selectors many times.
+    """
     # Parse the first piece as a selector, defaulting to DIV tag if none is specified
     if len(selector) > 0 and selector[0] in ['#', '.']:
-      self.tag = 'div'
+      tag = 'div'
     else:
       delimiter_index = None
       for i, char in enumerate(selector):
@@ -251,14 +972,14 @@ class Compiler(object):
           break
       
       if delimiter_index is None:
-        self.tag = selector
+        tag = selector
         selector = ""
       else:
-        self.tag = selector[:delimiter_index]
-        selector = selector[len(self.tag):]
+        tag = selector[:delimiter_index]
+        selector = selector[len(tag):]
     
-    self.tag_id = None
-    self.tag_classes = []
+    tag_id = None
+    tag_classes = []
     while True:
       next_delimiter_index = None
       if selector == "":
@@ -272,138 +993,265 @@ class Compiler(object):
         
         if next_delimiter_index is None:
           if selector[0] == '#':
-            self.tag_id = selector[1:]
+            tag_id = selector[1:]
           elif selector[0] == ".":
-            self.tag_classes.append(selector[1:])
+            tag_classes.append(selector[1:])
           
           selector = ""
         
         else:
           if selector[0] == '#':
-            self.tag_id = selector[1:next_delimiter_index]
+            tag_id = selector[1:next_delimiter_index]
           elif selector[0] == ".":
-            self.tag_classes.append(selector[1:next_delimiter_index])
+            tag_classes.append(selector[1:next_delimiter_index])
           
           selector = selector[next_delimiter_index:]
     
+    return tag, tag_id, tuple(tag_classes)
+  
+  def process_selector(self, selector):
+    self.tag, self.tag_id, tag_classes = self.__class__.parse_selector(selector)
+    self.tag_classes = list(tag_classes)
     return self
-    
-  def process_attributes(self, rest_of_line):
-    self.tag_attributes = []
-    while rest_of_line != "":
-      # If '=' doesn't exist, empty attribute string and break from loop
-      if '=' not in rest_of_line:
-        break
-      elif '=' in rest_of_line and '<' in rest_of_line and rest_of_line.index('<') < rest_of_line.index('='):
+  
+  @staticmethod
+  @functools.lru_cache(maxsize=attribute_cache_size)
+  def parse_attributes(rest_of_line):
+    """
+    Returns (tag_attributes, rest_of_line, unmatched) for the text after a
+    selector, where unmatched is the opening '{{' or '<%' of an unclosed
+    embedded value, or None. Results are kept in a bounded LRU cache.
+    """
+    tag_attributes = []
+    # Scan left to right from start instead of slicing off each attribute.
+    # equals_index and open_index are the first '=' and '<' at or after
+    # start, or -1.
+    start = 0
+    end = len(rest_of_line)
+    equals_index = rest_of_line.find('=')
+    open_index = rest_of_line.find('<')
+    while start < end:
+      # If '=' doesn't exist, or '<' comes first, stop
+      if equals_index == -1 or -1 < open_index < equals_index:
         break
       
-      first_equals_index = rest_of_line.index('=')
-      embedded_attribute = False
-      
-      if rest_of_line[first_equals_index+1:first_equals_index+3] == '{{':
-        embedded_attribute = True
-        try:
-          close_index = rest_of_line.index('}}')
-        except ValueError:
-          raise CompilerException("Unmatched '{{' found in line " + str(self.line_number))
-      elif rest_of_line[first_equals_index+1:first_equals_index+3] == '<%':
-        embedded_attribute = True
-        try:
-          close_index = rest_of_line.index('%>')
-        except ValueError:
-          raise CompilerException("Unmatched '<%' found in line " + str(self.line_number))
-      
-      if embedded_attribute:
-        current_attribute = rest_of_line[:close_index+2]
-        if len(rest_of_line) == close_index+2:
-          rest_of_line = ""
-        else:
-          rest_of_line = rest_of_line[close_index+2:]
+      value_start = rest_of_line[equals_index+1:equals_index+3]
+      if value_start == '{{' or value_start == '<%':
+        close_index = rest_of_line.find('}}' if value_start == '{{' else '%>', start)
+        if close_index == -1:
+          return tuple(tag_attributes), rest_of_line[start:], value_start
+        current_attribute = rest_of_line[start:close_index+2]
+        start = close_index + 2
       
-      elif len(rest_of_line) == first_equals_index+1:
-        current_attribute = rest_of_line.strip()
-        rest_of_line = ""
+      elif equals_index + 1 == end:
+        current_attribute = rest_of_line[start:].strip()
+        start = end
       
-      elif '=' not in rest_of_line[first_equals_index+1:]:
-        if '<' in rest_of_line:
-          current_attribute = rest_of_line[:rest_of_line.index('<')].strip()
-          rest_of_line = rest_of_line[rest_of_line.index('<'):]
+      elif rest_of_line.find('=', equals_index + 1) == -1:
+        if open_index != -1:
+          current_attribute = rest_of_line[start:open_index].strip()
+          start = open_index
         else:
-          current_attribute = rest_of_line
-          rest_of_line = ""
+          current_attribute = rest_of_line[start:]
+          start = end
       
       else:
-        second_equals_index = rest_of_line[first_equals_index+1:].index('=')
-        reversed_letters_between_equals = list(rest_of_line[first_equals_index+1:first_equals_index+1+second_equals_index])
-        reversed_letters_between_equals.reverse()
-        
-        whitespace_index = None
-        for i, char in enumerate(reversed_letters_between_equals):
-          try:
-            string.whitespace.index(char)
-          except (IndexError, ValueError):
-            pass
-          else:
-            whitespace_index = first_equals_index+1+second_equals_index - i
-            break
-        
-        if whitespace_index is None:
+        # The value runs to the last whitespace before the next '='
+        match = attribute_value_pattern.match(rest_of_line, equals_index + 1)
+        if match is None:
           # TODO: Do some error reporting here
           break
-        
-        current_attribute = rest_of_line[:whitespace_index].strip()
-        rest_of_line = rest_of_line[whitespace_index:]
+        current_attribute = rest_of_line[start:match.end()].strip()
+        start = match.end()
       
-      if current_attribute is not None:
-        equals_index = current_attribute.index('=')
-        self.tag_attributes.append(
-          ' ' + current_attribute[:equals_index] + '="' + current_attribute[equals_index+1:] + '"'
-        )
+      name_end = current_attribute.index('=')
+      tag_attributes.append(
+        ' ' + current_attribute[:name_end] + '="' + current_attribute[name_end+1:] + '"'
+      )
+      
+      equals_index = rest_of_line.find('=', start)
+      if -1 < open_index < start:
+        open_index = rest_of_line.find('<', start)
     
-    return rest_of_line.strip()
-
+    return tuple(tag_attributes), rest_of_line[start:].strip(), None
+  
+  @classmethod
+  def get_attributes(cls, rest_of_line):
+    """
+    Returns parse_attributes(rest_of_line), but only looks up the attributes
+    in the cache. Where it cannot change how they parse, the inner text
+    after them is split off first: the first '<' does not open '<%' and has
+    no '=' after it and no '{{' before it. Lines that differ only in their
+    inner text then share an entry, and the cache does not keep the text.
+    """
+    open_index = rest_of_line.find('<')
+    if open_index > 0 and rest_of_line.find('=', open_index) == -1 and \
+        rest_of_line.find('{{', 0, open_index) == -1 and not rest_of_line.startswith('<%', open_index):
+      attributes = rest_of_line[:open_index].rstrip()
+      if len(attributes) <= attribute_cache_max_length:
+        tag_attributes, rest, unmatched = cls.parse_attributes(attributes)
+        # Otherwise the attributes did not parse to their end on their own
+        if rest == "":
+          return tag_attributes, rest_of_line[open_index:].strip(), unmatched
+    
+    if len(rest_of_line) > attribute_cache_max_length:
+      return cls.parse_attributes.__wrapped__(rest_of_line)
+    return cls.parse_attributes(rest_of_line)
+  
+  def process_attributes(self, rest_of_line):
+    # Most lines have no attributes; skip the cache for them
+    if '=' not in rest_of_line:
+      self.tag_attributes = []
+      return rest_of_line.strip()
+    
+    tag_attributes, rest_of_line, unmatched = self.__class__.get_attributes(rest_of_line)
+    if unmatched is not None:
+      raise CompilerException("Unmatched '" + unmatched + "' found in line " + str(self.line_number),
+        self.line_number)
+    self.tag_attributes = list(tag_attributes)
+    return rest_of_line
+  
+  @classmethod
+  def get_cache_info(cls):
+    """
+    Returns the hits, misses and sizes of the selector and attribute caches,
+    as a dict of functools CacheInfo tuples.
+    """
+    return {
+      'selectors': cls.parse_selector.cache_info(),
+      'attributes': cls.parse_attributes.cache_info(),
+    }
+  
+  @classmethod
+  def clear_caches(cls):
+    cls.parse_selector.cache_clear()
+    cls.parse_attributes.cache_clear()
+    with partial_cache_lock:
+      partial_cache.clear()
+  
+  def add_node(self, node):
+    if self.indent_token == "":
+      self.document.unindented_count += 1
+    if len(self.open_nodes) > 0:
+      self.open_nodes[-1].children.append(node)
+    else:
+      self.document.children.append(node)
+    return self
+  
+  def add_element_to_document(self):
+    element = Element(
+      self.tag,
+      self.tag_id,
+      list(self.tag_classes),
+      # tag_attributes hold ' name="value"' strings
+      [tuple(attribute[1:-1].split('="', 1)) for attribute in self.tag_attributes],
+      self.inner_text,
+      self.self_closing,
+      self.current_level
+    )
+    self.add_node(element)
+    if not self.self_closing and self.inner_text is None:
+      self.open_tags.append(
+        (self.current_level, self.tag)
+      )
+      self.open_nodes.append(element)
+    return self
+  
   def add_html_to_output(self):
-    if not self.line_starts_with_tick:
-      tag_html = "<" + self.tag
+    if self.checking:
+      if not self.line_starts_with_tick and not self.self_closing and self.inner_text is None:
+        self.open_tags.append(
+          (self.current_level, self.tag)
+        )
+    
+    elif self.document is not None:
+      if not self.line_starts_with_tick:
+        self.add_element_to_document()
+    
+    elif not self.line_starts_with_tick:
+      # Collect the pieces of the tag and hand them to the sink as one fragment
+      parts = []
+      if not self.compress:
+        parts.append(self.current_level * self.indent_token)
+      parts.append("<")
+      parts.append(self.tag)
       
       if self.tag_id is not None:
-        tag_html += ' id="' + self.tag_id + '"'
-        
+        parts.append(' id="')
+        parts.append(self.tag_id)
+        parts.append('"')
+      
       if len(self.tag_classes) > 0:
-        tag_html += ' class="' + ' '.join(self.tag_classes) + '"'
+        parts.append(' class="')
+        parts.append(' '.join(self.tag_classes))
+        parts.append('"')
       
       if len(self.tag_attributes) > 0:
-        tag_html += ''.join(self.tag_attributes)
+        parts.extend(self.tag_attributes)
       
       if self.self_closing:
-        tag_html += ' />'
-        if not self.compress:
-          self.output += self.current_level * self.indent_token
-        self.output += tag_html
-        if not self.compress:
-          self.output += '\n'
+        parts.append(' />')
       
       else:
-        tag_html += '>'
-        
-        if self.inner_text is not None:
-          tag_html += self.inner_text
-        
-        if not self.compress:
-          self.output += self.current_level * self.indent_token
-        self.output += tag_html
+        parts.append('>')
         
         if self.inner_text is None:
-          if not self.compress:
-            self.output += '\n'
           # Add tag data to open_tags list
           self.open_tags.append(
             (self.current_level, self.tag)
           )
-    
+        
         else:
-          self.output += "</" + self.tag + ">"
-          if not self.compress:
-            self.output += "\n"
+          parts.append(self.inner_text)
+          parts.append("</")
+          parts.append(self.tag)
+          parts.append(">")
+      
+      if not self.compress:
+        parts.append('\n')
+      self.sink.write(''.join(parts))
     
     return self
+
+def iter_compile(lines, compress=False, compiler=None, source_path=None):
+  """
+  Compiles an iterable of lines, such as a file object or a generator, and
+  yields the HTML in chunks as soon as they are final. Lines should keep
+  their line breaks, as they do when iterating over a file. Memory use
+  depends on the nesting depth, not on the size of the document. Pass a
+  compiler to reuse it, e.g. one with profiling enabled, and source_path
+  to resolve includes relative to the source file.
+  """
+  if compiler is None:
+    compiler = Compiler()
+  compiler.reset(compress=compress, source=lines, source_path=source_path)
+  sink = compiler.sink
+  
+  while compiler.has_more_text():
+    compiler.process_current_level().close_lower_level_tags().process_next_line()
+    chunk = sink.drain()
+    if chunk:
+      yield chunk
+  
+  compiler.finish()
+  chunk = sink.drain()
+  if chunk:
+    yield chunk
+
+def iter_mapped_lines(mapping):
+  """
+  Yields the lines of a UTF-8 buffer, such as an mmap, with their line
+  breaks. Each line is decoded straight from the buffer, without copying
+  it to bytes first.
+  """
+  view = memoryview(mapping)
+  try:
+    position = 0
+    size = len(view)
+    while position < size:
+      line_break_index = mapping.find(b"\n", position)
+      end = size if line_break_index == -1 else line_break_index + 1
+      yield str(view[position:end], 'utf-8')
+      position = end
+  finally:
+    view.release()
@@ -0,0 +1,176 @@
+"""
+Checks that the compiler engines agree. Run it with
+
+  python -m wieldymarkup.differential
+
+to compile random documents, valid and not, with every engine in both
+compress modes, and report any document on which their output or
+CompilerException message, and so its line number, differ. It then
+reports the throughput of each engine on the same inputs, relative to the
+reference engine.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import sys, os, time, random, argparse
+
+if __package__ in (None, ""):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wieldymarkup.compile import Compiler, CompilerException
+from wieldymarkup.benchmark import generate_document, cases, quick_cases
+
+selector_pieces = ['div', 'span', 'p', 'a', 'li', 'input', '', '.row', '.btn-x', '#main', '#', '.']
+attribute_names = ['href', 'data-x', 'readonly', 'type', 'v']
+attribute_values = ['#', 'x', '', '{{ value }}', '<%= value %>', 'a b', 'q=z', '1', 'a<b', '{{a}}b']
+inner_texts = [
+  '<hi>', '<a <b> c>', '<<%= v %> t>', '<p\n  more>', '<p\n more\n   end>', '<p\nmore>', '<p\n\n>',
+  '>', '/', '/x/', '<{{ a }}>', 'text', 'a=b <t>',
+]
+embedded_lines = ['`<br>', '`<% x %>', '`  hi  ', '`']
+blank_lines = ['', '   ', '\t', ' \t ']
+# Pieces that make a document fail to compile
+invalid_attribute_values = ['{{ x', '<% y']
+invalid_inner_texts = ['<x', '<a> <b>', 'y>', '<', '<a\n<b']
+
+def generate_line(rng, invalid_ratio):
+  choice = rng.random()
+  if choice < 0.1:
+    return rng.choice(embedded_lines)
+  if choice < 0.18:
+    return rng.choice(blank_lines)
+  
+  segments = []
+  for i in range(rng.choice([1, 1, 1, 2, 3])):
+    segment = ''.join(rng.choice(selector_pieces) for j in range(rng.randint(1, 3))) or 'div'
+    for j in range(rng.randint(0, 3)):
+      if rng.random() < invalid_ratio:
+        value = rng.choice(invalid_attribute_values)
+      else:
+        value = rng.choice(attribute_values)
+      segment += ' ' + rng.choice(attribute_names) + '=' + value
+    segments.append(segment)
+  line = ' \\-\\ '.join(segments)
+  
+  if rng.random() < 0.6:
+    if rng.random() < invalid_ratio:
+      line += ' ' + rng.choice(invalid_inner_texts)
+    else:
+      line += ' ' + rng.choice(inner_texts)
+  return line
+
+def generate_random_document(rng, lines=25, invalid_ratio=0.02):
+  """
+  Returns a random document of up to lines lines, with random indentation,
+  line breaks and nesting. About invalid_ratio of its attribute values and
+  inner texts are ones that do not compile.
+  """
+  indent_token = rng.choice(['  ', '    ', '\t', ' '])
+  line_break = rng.choice(['\n', '\n', '\r\n'])
+  document_lines = []
+  level = 0
+  for i in range(rng.randint(0, lines)):
+    level = max(0, level + rng.choice([-2, -1, 0, 0, 1, 1, 2]))
+    document_lines.append(indent_token * level + generate_line(rng, invalid_ratio))
+  text = line_break.join(document_lines)
+  if rng.random() < 0.5:
+    text += line_break
+  return text
+
+def run_engine(engine, text, compress=False):
+  """
+  Returns ('output', html) for a document that compiles, or ('error',
+  message) for one that raises a CompilerException.
+  """
+  try:
+    return 'output', Compiler(text, compress=compress, engine=engine).output
+  except CompilerException as e:
+    return 'error', str(e)
+
+def compare_engines(texts, engines=Compiler.engines):
+  """
+  Compiles each of texts with each of engines, in both compress modes, and
+  returns (text, compress, {engine: result}) for every text on which they
+  do not all give the same result.
+  """
+  mismatches = []
+  for text in texts:
+    for compress in (False, True):
+      results = dict((engine, run_engine(engine, text, compress)) for engine in engines)
+      if len(set(results.values())) > 1:
+        mismatches.append((text, compress, results))
+  return mismatches
+
+def time_engine(engine, texts, repeat=3):
+  """
+  Returns the best wall time, in seconds, of repeat runs compiling all of
+  texts with engine.
+  """
+  compiler = Compiler(engine=engine)
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    for text in texts:
+      compiler.compile(text)
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def get_corpora(texts, quick=False):
+  """
+  Returns (name, texts) pairs to time the engines on: the random documents
+  that compile, and the benchmark cases.
+  """
+  corpora = [("random", [text for text in texts if run_engine('reference', text)[0] == 'output'])]
+  for name, kwargs in cases:
+    if name in quick_cases or not quick:
+      corpora.append((name, [generate_document(**kwargs)]))
+  return corpora
+
+def get_argument_parser():
+  parser = argparse.ArgumentParser(prog="python -m wieldymarkup.differential",
+    description="Check that the WieldyMarkup compiler engines agree, and compare their throughput.")
+  parser.add_argument("-n", dest="count", type=int, default=5000, metavar="N",
+    help="number of random documents to compare (default: 5000)")
+  parser.add_argument("--seed", type=int, default=0,
+    help="seed of the random documents (default: 0)")
+  parser.add_argument("--quick", action="store_true",
+    help="time only the smaller benchmark cases")
+  parser.add_argument("--repeat", type=int, default=3, metavar="N",
+    help="runs per measurement; the fastest is kept (default: 3)")
+  return parser
+
+def main(argv=None, stream=sys.stdout):
+  args = get_argument_parser().parse_args(sys.argv[1:] if argv is None else argv)
+  
+  rng = random.Random(args.seed)
+  texts = [generate_random_document(rng) for i in range(args.count)]
+  mismatches = compare_engines(texts)
+  for text, compress, results in mismatches[:10]:
+    stream.write("MISMATCH compress=" + str(compress) + " " + repr(text) + "\n")
+    for engine in Compiler.engines:
+      stream.write("  " + engine + ": " + repr(results[engine]) + "\n")
+  stream.write("%d documents, %d mismatches\n" % (len(texts), len(mismatches)))
+  
+  stream.write("%-16s %8s" % ("corpus", "MB") + ''.join(" %20s" % (engine + " MB/s") for engine in Compiler.engines) + "\n")
+  for name, corpus in get_corpora(texts, args.quick):
+    megabytes = sum(len(text.encode('utf-8')) for text in corpus) / 1e6
+    row = "%-16s %8.3f" % (name, megabytes)
+    reference_time = None
+    for engine in Compiler.engines:
+      seconds = time_engine(engine, corpus, args.repeat)
+      cell = "%.1f" % (megabytes / seconds)
+      if reference_time is None:
+        reference_time = seconds
+      else:
+        cell += " (x%.2f)" % (reference_time / seconds)
+      row += " %20s" % cell
+    stream.write(row + "\n")
+    stream.flush()
+  
+  return 1 if mismatches else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Renders a parsed document as minified HTML: whitespace in text is
+collapsed, optional attribute quotes and end tags are dropped, and the
+content of pre, textarea, script and style elements and of template
+delimiters is left as it is.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import re
+
+from wieldymarkup.tree import Embedded
+
+# Elements whose content is whitespace sensitive or not HTML
+raw_text_tags = frozenset(['pre', 'textarea', 'script', 'style'])
+
+void_tags = frozenset([
+  'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'meta', 'param',
+  'source', 'track', 'wbr',
+])
+
+# Elements that may follow a p element whose end tag was left out
+p_closing_tags = frozenset([
+  'address', 'article', 'aside', 'blockquote', 'details', 'dialog', 'div', 'dl', 'fieldset',
+  'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hgroup',
+  'hr', 'main', 'menu', 'nav', 'ol', 'p', 'pre', 'search', 'section', 'table', 'ul',
+])
+
+# Elements that implicitly close a p element they appear in
+p_breaking_tags = p_closing_tags | frozenset(['center', 'dd', 'dir', 'dt', 'li', 'listing', 'plaintext',
+  'summary', 'xmp'])
+
+# Parents in which a p element may leave out its end tag. Others, such as
+# a, ins or phrasing elements, keep it.
+p_parent_tags = frozenset([
+  'address', 'article', 'aside', 'blockquote', 'body', 'dd', 'details', 'dialog', 'div', 'fieldset',
+  'figcaption', 'figure', 'footer', 'form', 'header', 'li', 'main', 'nav', 'search', 'section', 'td',
+  'th',
+])
+
+# For each element whose end tag may be omitted, the parents it must be
+# in, the tags of the next siblings that allow it, and whether being the
+# last child allows it
+optional_end_tags = {
+  'li': (frozenset(['ul', 'ol', 'menu']), frozenset(['li']), True),
+  'dt': (frozenset(['dl']), frozenset(['dt', 'dd']), False),
+  'dd': (frozenset(['dl']), frozenset(['dt', 'dd']), True),
+  'option': (frozenset(['select', 'datalist', 'optgroup']), frozenset(['option', 'optgroup']), True),
+  'optgroup': (frozenset(['select']), frozenset(['optgroup']), True),
+  'tr': (frozenset(['table', 'thead', 'tbody', 'tfoot']), frozenset(['tr']), True),
+  'td': (frozenset(['tr']), frozenset(['td', 'th']), True),
+  'th': (frozenset(['tr']), frozenset(['td', 'th']), True),
+  'thead': (frozenset(['table']), frozenset(['tbody', 'tfoot']), False),
+  'tbody': (frozenset(['table']), frozenset(['tbody', 'tfoot']), True),
+  'tfoot': (frozenset(['table']), frozenset(), True),
+  'rt': (frozenset(['ruby']), frozenset(['rt', 'rp']), True),
+  'rp': (frozenset(['ruby']), frozenset(['rt', 'rp']), True),
+  'p': (p_parent_tags, p_closing_tags, True),
+}
+
+whitespace_pattern = re.compile(r"\s+")
+unquoted_value_pattern = re.compile(r"[^\s\"'=<>`{]+$")
+html_token_pattern = re.compile(r"(\{\{.*?\}\}|<%.*?%>|<[^>]*>)", re.S)
+raw_text_tag_pattern = re.compile(r"<(/?)(pre|textarea|script|style)\b", re.I)
+
+def minify_html(html, raw_text_tag=None):
+  """
+  Collapses whitespace in the text between the tags of an HTML fragment,
+  and returns (html, raw_text_tag). raw_text_tag is the raw text element
+  the fragment starts in, or None, and the one it ends in is returned, so
+  a pre or script element can span several fragments.
+  """
+  pieces = html_token_pattern.split(html)
+  for i, piece in enumerate(pieces):
+    if i % 2 == 1:
+      match = raw_text_tag_pattern.match(piece)
+      if match is not None:
+        tag = match.group(2).lower()
+        if match.group(1) == "" and raw_text_tag is None:
+          raw_text_tag = tag
+        elif match.group(1) == "/" and raw_text_tag == tag:
+          raw_text_tag = None
+    elif raw_text_tag is None:
+      pieces[i] = whitespace_pattern.sub(' ', piece)
+  return ''.join(pieces), raw_text_tag
+
+def get_minified_start_tag(element):
+  attributes = []
+  if element.id is not None:
+    attributes.append(('id', element.id))
+  if len(element.classes) > 0:
+    attributes.append(('class', ' '.join(element.classes)))
+  attributes.extend(element.attributes)
+  
+  parts = ["<", element.tag]
+  unquoted = False
+  for name, value in attributes:
+    unquoted = False
+    if value == "":
+      parts.append(' ' + name)
+    elif unquoted_value_pattern.match(value):
+      parts.append(' ' + name + '=' + value)
+      unquoted = True
+    else:
+      parts.append(' ' + name + '="' + value + '"')
+  
+  if element.self_closing and element.tag.lower() not in void_tags:
+    # Foreign elements, e.g. in SVG, need the slash
+    parts.append(' />' if unquoted else '/>')
+  else:
+    parts.append('>')
+  return ''.join(parts)
+
+def has_optional_end_tag(element, following, parent):
+  """
+  Returns whether the end tag of element can be left out, given the node
+  after it (None if it is the last child) and its parent element (None at
+  the top level, where the context it will be used in is not known).
+  """
+  tag = element.tag.lower()
+  if tag in void_tags:
+    return True
+  if tag == 'html':
+    return parent is None and following is None
+  if tag == 'body':
+    return parent is not None and parent.tag.lower() == 'html' and following is None
+  if tag == 'head':
+    return parent is not None and following is not None and not isinstance(following, Embedded)
+  if tag not in optional_end_tags or parent is None or isinstance(following, Embedded):
+    return False
+  
+  parent_tags, following_tags, last_child = optional_end_tags[tag]
+  if parent.tag.lower() not in parent_tags:
+    return False
+  if tag == 'p' and not is_phrasing(element):
+    # The parser already closed it, and its end tag opens an empty p
+    return False
+  if following is None:
+    return last_child
+  return following.tag.lower() in following_tags
+
+def is_phrasing(element):
+  """
+  Returns whether nothing inside element implicitly closes a p element.
+  """
+  stack = [element.children]
+  while stack:
+    for node in stack.pop():
+      if isinstance(node, Embedded) or node.tag.lower() in p_breaking_tags:
+        return False
+      stack.append(node.children)
+  return True
+
+def render_minified(document):
+  """
+  Returns the minified HTML for a wieldymarkup.tree.Document.
+  """
+  fragments = []
+  # The raw text element that embedded HTML left open, if any
+  raw_text_tag = None
+  # Frames of [parent, nodes, index of the next node, inside raw text]
+  stack = [[None, document.children, 0, False]]
+  while stack:
+    frame = stack[-1]
+    parent, nodes, index, raw = frame
+    if index == len(nodes):
+      stack.pop()
+      if parent is not None:
+        outer_parent, outer_nodes, outer_index = stack[-1][:3]
+        following = outer_nodes[outer_index] if outer_index < len(outer_nodes) else None
+        if not has_optional_end_tag(parent, following, outer_parent):
+          fragments.append("</" + parent.tag + ">")
+      continue
+    
+    frame[2] += 1
+    node = nodes[index]
+    following = nodes[index + 1] if index + 1 < len(nodes) else None
+    if isinstance(node, Embedded):
+      if raw:
+        fragments.append(node.html)
+      else:
+        html, raw_text_tag = minify_html(node.html, raw_text_tag)
+        fragments.append(html)
+      continue
+    
+    fragments.append(get_minified_start_tag(node))
+    node_raw = raw or raw_text_tag is not None or node.tag.lower() in raw_text_tags
+    if node.self_closing:
+      pass
+    elif node.inner_text is not None:
+      if raw or node.tag.lower() in raw_text_tags:
+        fragments.append(node.inner_text)
+      else:
+        # Inner text can open or close a raw text element, like embedded HTML
+        html, raw_text_tag = minify_html(node.inner_text, raw_text_tag)
+        fragments.append(html)
+      if not has_optional_end_tag(node, following, parent):
+        fragments.append("</" + node.tag + ">")
+    else:
+      stack.append([node, node.children, 0, node_raw])
+  
+  return ''.join(fragments)
@@ -0,0 +1,161 @@
+"""
+Compiles many documents in one call, in this thread or across a pool of
+threads or processes, or one huge document in shards across a pool of
+processes.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import threading, functools
+from concurrent.futures import ThreadPoolExecutor
+
+from wieldymarkup.compile import Compiler, CompilerException, UnterminatedTextException
+from wieldymarkup.build import run_jobs
+
+executors = (None, 'thread', 'process')
+
+# Each worker thread or process keeps one Compiler for all of its items
+worker_state = threading.local()
+
+# Characters of text per shard in compile_sharded
+shard_size = 4 * 1024 * 1024
+
+def get_worker_compiler():
+  compiler = getattr(worker_state, 'compiler', None)
+  if compiler is None:
+    compiler = worker_state.compiler = Compiler()
+  return compiler
+
+def compile_item(text, compress=False, minify=False, source_path=None):
+  """
+  Returns the compiled text, or the exception that stopped the compile,
+  using the Compiler of the current worker.
+  """
+  compiler = get_worker_compiler()
+  try:
+    return compiler.compile(text, compress=compress, source_path=source_path, minify=minify).output
+  except Exception as e:
+    return e
+
+def compile_many(texts, compress=False, executor=None, workers=None, minify=False):
+  """
+  Compiles each of texts and returns a list of the outputs in the same
+  order. A text that fails to compile does not stop the others: its place
+  in the list holds the exception instead of a string.
+  
+  executor is None to compile in this thread, 'thread' for a pool of
+  threads, or 'process' for a pool of processes. workers is the size of the
+  pool, one per CPU by default.
+  """
+  if executor not in executors:
+    raise ValueError("executor must be None, 'thread' or 'process', not " + repr(executor))
+  
+  texts = list(texts)
+  worker = functools.partial(compile_item, compress=compress, minify=minify)
+  if executor is None:
+    return [worker(text) for text in texts]
+  elif executor == 'thread':
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      return list(pool.map(worker, texts))
+  else:
+    return run_jobs(worker, texts, workers)
+
+def find_shard_starts(text, size=None):
+  """
+  Returns the offsets of the lines at which compile_sharded splits text,
+  the first line without indentation at or after every size characters.
+  The compiler closes every open tag before such a line, unless it
+  continues the inner text of the line before it.
+  """
+  size = shard_size if size is None else size
+  starts = [0]
+  position = size
+  while position < len(text):
+    line_start = text.find("\n", position - 1) + 1
+    while 0 < line_start < len(text) and text[line_start] in " \t":
+      line_start = text.find("\n", line_start) + 1
+    if line_start <= 0 or line_start >= len(text):
+      break
+    starts.append(line_start)
+    position = line_start + size
+  return starts
+
+def compile_shard(shard, compress=False, indent_token="", source_path=None):
+  """
+  Compiles a shard, a (text, line_number, last) tuple where line_number is
+  the number of lines before text in the document and last is set for the
+  final shard, as if indent_token had been found in the lines before it.
+  Returns the output, or the exception that stopped the compile, or None
+  if text ends inside a multi-line inner text that the next shard goes on
+  with.
+  """
+  text, line_number, last = shard
+  compiler = get_worker_compiler()
+  compiler.reset(text, compress, source_path=source_path)
+  compiler.indent_token = indent_token
+  compiler.line_number = line_number
+  try:
+    return compiler.process_text().output
+  except CompilerException as e:
+    if not last and isinstance(e, UnterminatedTextException):
+      return None
+    return e
+  except Exception as e:
+    return e
+
+def compile_sharded(text, compress=False, workers=None, size=None, source_path=None):
+  """
+  Compiles one large document across a pool of processes (workers, one per
+  CPU by default), and returns the same output, or raises the same
+  exception, as Compiler.compile. The text is split into shards of about
+  size characters at lines without indentation, and the shards are
+  compiled in parallel and their outputs joined in order.
+  
+  Shards are compiled in this process until one of them sets the indent
+  token, which the rest are then given. A shard that ends inside a
+  multi-line inner text is compiled again together with the next shard.
+  """
+  text = str(text)
+  starts = find_shard_starts(text, size) + [len(text)]
+  shards = []
+  line_number = 0
+  for i in range(len(starts) - 1):
+    shard_text = text[starts[i]:starts[i+1]]
+    shards.append((shard_text, line_number, i == len(starts) - 2))
+    line_number += shard_text.count("\n")
+  
+  def merge(first, last):
+    return (''.join(shard[0] for shard in shards[first:last]), shards[first][1], shards[last-1][2])
+  
+  outputs = []
+  indent_token = ""
+  index = 0
+  while index < len(shards) and indent_token == "":
+    end = index + 1
+    output = compile_shard(shards[index], compress, indent_token, source_path)
+    while output is None:
+      end += 1
+      output = compile_shard(merge(index, end), compress, indent_token, source_path)
+    if isinstance(output, Exception):
+      raise output
+    outputs.append(output)
+    indent_token = get_worker_compiler().indent_token
+    index = end
+  
+  worker = functools.partial(compile_shard, compress=compress, indent_token=indent_token,
+    source_path=source_path)
+  results = run_jobs(worker, shards[index:], workers)
+  i = 0
+  while i < len(results):
+    output = results[i]
+    end = index + i + 1
+    while output is None:
+      end += 1
+      output = worker(merge(index + i, end))
+    if isinstance(output, Exception):
+      raise output
+    outputs.append(output)
+    i = end - index
+  
+  return ''.join(outputs)
@@ -0,0 +1,148 @@
+"""
+Keeps a compiler process warm behind a Unix domain socket, so editors and
+build tools that compile one file per call pay a local round trip instead
+of interpreter startup. Start the server with
+
+  python /path/to/wieldymarkup serve --socket PATH
+
+and compile through it with
+
+  python /path/to/wieldymarkup client --socket PATH FILE...
+
+Each request is one line of JSON, answered by one line of JSON, so any
+tool that can write to a Unix socket can be a client. A request holds
+either "text", the source to compile, or "path", a .wml file to compile
+into an .html file next to it, along with any of the options "compress",
+"minify", "precompress" and "strict". With "write": false, a path is
+compiled without writing the .html file. The reply holds "html", the
+compiled text, or "output", the path of the .html file written, or
+"error", the message of the exception that stopped the compile. The
+client command lives in wieldymarkup.client, which does not import the
+compiler.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import sys, os, io, json, signal, socket, argparse, threading, socketserver
+
+class RequestHandler(socketserver.StreamRequestHandler):
+  """
+  Answers each line of JSON read from a connection until the client closes
+  it.
+  """
+  
+  def handle(self):
+    for line in self.rfile:
+      if not line.strip():
+        continue
+      try:
+        request = json.loads(line.decode('utf-8'))
+        if not isinstance(request, dict):
+          raise ValueError("Request must be a JSON object.")
+        reply = self.server.process(request)
+      except Exception as e:
+        reply = {'error': str(e)}
+      self.wfile.write(json.dumps(reply).encode('utf-8') + b"\n")
+      self.wfile.flush()
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  """
+  Listens on the Unix domain socket at socket_path. Connections are served
+  in threads, but compiles run one at a time in a single Compiler, which
+  keeps the selector, attribute and include caches warm between requests.
+  The compiler is imported here rather than with the module, so loading
+  the module stays cheap.
+  """
+  
+  daemon_threads = True
+  
+  def __init__(self, socket_path):
+    if os.path.exists(socket_path):
+      if is_listening(socket_path):
+        raise Exception("A server is already listening on " + socket_path)
+      # Left behind by a server that did not shut down cleanly
+      os.remove(socket_path)
+    from wieldymarkup.compile import Compiler
+    from wieldymarkup.build import compile_file_from_path, is_source_file
+    self.socket_path = socket_path
+    self.compiler = Compiler()
+    self.compile_file_from_path = compile_file_from_path
+    self.is_source_file = is_source_file
+    self.lock = threading.Lock()
+    socketserver.UnixStreamServer.__init__(self, socket_path, RequestHandler)
+  
+  def process(self, request):
+    """
+    Returns the reply to one request.
+    """
+    compress = bool(request.get('compress', False))
+    minify = bool(request.get('minify', False))
+    if 'text' in request:
+      with self.lock:
+        html = self.compiler.compile(request['text'], compress=compress,
+          source_path=request.get('source_path'), minify=minify).output
+      return {'html': html}
+    
+    if 'path' not in request:
+      raise ValueError("Request must have a text or path.")
+    filepath = request['path']
+    strict = bool(request.get('strict', True))
+    if not request.get('write', True):
+      # Skipped or rejected like a path that is written
+      if not self.is_source_file(filepath, strict):
+        return {'html': None}
+      with io.open(filepath, 'r', encoding='utf-8', newline='') as f:
+        text = f.read()
+      with self.lock:
+        html = self.compiler.compile(text, compress=compress, source_path=filepath, minify=minify).output
+      return {'html': html}
+    
+    with self.lock:
+      output = self.compile_file_from_path(filepath, strict=strict,
+        compress=compress, compiler=self.compiler, minify=minify,
+        precompress=bool(request.get('precompress', False)))
+    return {'output': output}
+  
+  def server_close(self):
+    socketserver.UnixStreamServer.server_close(self)
+    if os.path.exists(self.socket_path):
+      os.remove(self.socket_path)
+
+def is_listening(socket_path):
+  """
+  Returns whether a server accepts connections on socket_path.
+  """
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    client.connect(socket_path)
+  except socket.error:
+    return False
+  finally:
+    client.close()
+  return True
+
+def get_argument_parser():
+  parser = argparse.ArgumentParser(prog="wieldymarkup serve",
+    description="Compile WieldyMarkup for clients connecting to a Unix domain socket.")
+  parser.add_argument("--socket", required=True, metavar="PATH",
+    help="path of the Unix domain socket")
+  return parser
+
+def serve(args):
+  server = CompileServer(args.socket)
+  # Remove the socket on kill as well as on Ctrl+C
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+  return 0
+
+def main(argv):
+  """
+  Runs the serve command with argv, the arguments that follow it.
+  """
+  return serve(get_argument_parser().parse_args(argv))
@@ -1,3 +1,5 @@
+import io, os, sys, codecs, pickle, shutil, tempfile, subprocess
+from concurrent.futures import ThreadPoolExecutor
 import six
 
 if six.PY3:
@@ -5,7 +7,11 @@ if six.PY3:
 else:
   import unittest2 as unittest
 
-from wieldymarkup.compile import Compiler, CompilerException
+from wieldymarkup import compile as compile_module
+from wieldymarkup.compile import Compiler, CompilerException, UnterminatedTextException, iter_compile, \
+  partial_cache
+from wieldymarkup.parallel import compile_many, compile_sharded, compile_shard, find_shard_starts
+from wieldymarkup.tree import Document, Element, Embedded, render, render_pretty, render_compressed
 
 class TestCompiler(unittest.TestCase):
 
@@ -204,6 +210,25 @@ class TestCompiler(unittest.TestCase):
     rest_of_line = c.process_attributes("val1=val1 data-val2=<%= val2 %> <asdf <%= val3 %>>")
     self.assertEqual(c.tag_attributes, [' val1="val1"', ' data-val2="<%= val2 %>"'])
     self.assertEqual(rest_of_line, "<asdf <%= val3 %>>")
+    
+    c = Compiler()
+    rest_of_line = c.process_attributes("value={{ q }} title=a b readonly= <text>")
+    self.assertEqual(c.tag_attributes, [' value="{{ q }}"', ' title="a b"', ' readonly=""'])
+    self.assertEqual(rest_of_line, "<text>")
+    
+    c = Compiler()
+    rest_of_line = c.process_attributes("checked= type=text /")
+    self.assertEqual(c.tag_attributes, [' checked=""', ' type="text /"'])
+    self.assertEqual(rest_of_line, "")
+    
+    c = Compiler()
+    attributes = ' '.join("a" + str(i) + "=" + str(i) for i in range(500))
+    rest_of_line = c.process_attributes(attributes + " <text>")
+    self.assertEqual(c.tag_attributes, [' a' + str(i) + '="' + str(i) + '"' for i in range(500)])
+    self.assertEqual(rest_of_line, "<text>")
+    
+    c = Compiler()
+    self.assertRaises(CompilerException, c.process_attributes, "a=1 b={{ c")
   
   def test_process_next_line(self):
     c = Compiler()
@@ -238,6 +263,24 @@ class TestCompiler(unittest.TestCase):
     c.process_next_line()
     self.assertEqual(c.output, '<div>\n  <a href="#" target="_blank">\n    <span>asdf</span>\n')
   
+  def test_process_inner_text(self):
+    c = Compiler()
+    c.process_inner_text("<asdf>")
+    self.assertEqual(c.inner_text, "asdf")
+    
+    c = Compiler()
+    c.text = "  more <%= val %>\n    text>\ndiv"
+    c.process_inner_text("<Lorem")
+    self.assertEqual(c.inner_text, "Lorem more <%= val %> text")
+    self.assertEqual(c.text[c.position:], "div")
+    
+    c = Compiler()
+    c.text = "  text"
+    self.assertRaises(CompilerException, c.process_inner_text, "<Lorem")
+    
+    c = Compiler()
+    self.assertRaises(CompilerException, c.process_inner_text, "<Lorem>>")
+  
   def test_add_html_to_output(self):
     c = Compiler()
     c.line_starts_with_tick = True
@@ -269,6 +312,396 @@ class TestCompiler(unittest.TestCase):
     c.add_html_to_output()
     self.assertEqual(c.output, '<span><%= val1 %></span>')
   
+  def test_example(self):
+    example_path = os.path.join(os.path.dirname(__file__), '..', '..', 'example')
+    with io.open(os.path.join(example_path, 'python-markup-test.html'), 'r', encoding='utf-8', newline='') as f:
+      html = f.read()
+    with io.open(os.path.join(example_path, 'python-markup-test.wml'), 'r', encoding='utf-8', newline='') as f:
+      text = f.read()
+    for engine in Compiler.engines:
+      self.assertEqual(Compiler(text, engine=engine).output, html)
+    self.assertEqual(Compiler().compile_path(os.path.join(example_path, 'python-markup-test.wml')).output, html)
+    self.assertEqual(''.join(iter_compile(io.StringIO(text))), html)
+  
+  def test_final_line(self):
+    fd, filepath = tempfile.mkstemp(suffix=".wml")
+    os.close(fd)
+    def compile_all(text, compress=False):
+      with io.open(filepath, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+      outputs = [Compiler(text, compress=compress, engine=engine).output for engine in Compiler.engines]
+      outputs.append(Compiler().compile_path(filepath, compress=compress).output)
+      outputs.append(''.join(iter_compile(io.StringIO(text), compress=compress)))
+      self.assertEqual(len(set(outputs)), 1, repr(text))
+      return outputs[0]
+    
+    try:
+      # Whitespace-only documents compile to nothing
+      for text in ["", "   ", "\t", "  \n\t\n \n", "\r\n  \r\n"]:
+        self.assertEqual(compile_all(text), "")
+        self.assertEqual(compile_all(text, compress=True), "")
+      
+      # The last line compiles the same with or without a line break after it
+      for text, html, compressed in [
+        ("div\n  span <x>", "<div>\n  <span>x</span>\n</div>\n", "<div><span>x</span></div>"),
+        ("div\n  `<br>", "<div>\n  <br>\n</div>\n", "<div><br></div>"),
+        ("ul\n  li <a\n    b>\n", "<ul>\n  <li>a b</li>\n</ul>\n", "<ul><li>a b</li></ul>"),
+        ("div\r\n  p", "<div>\n  <p>\n  </p>\n</div>\n", "<div><p></p></div>"),
+      ]:
+        for ending in ["", "\n", "\n  "]:
+          self.assertEqual(compile_all(text + ending), html)
+          self.assertEqual(compile_all(text + ending, compress=True), compressed)
+      
+      # As in the original compiler, inner text that ends the document
+      # unterminated keeps the indentation of its continuation lines
+      self.assertEqual(compile_all("ul\n  li <a\n    b>"), "<ul>\n  <li>a    b</li>\n</ul>\n")
+    finally:
+      os.remove(filepath)
+  
+  def test_compile_to(self):
+    text = "div\n  a href=# <Link>\n  span <\u00e9>\n"
+    
+    stream = io.StringIO()
+    c = Compiler()
+    c.compile_to(stream, text)
+    self.assertEqual(stream.getvalue(), Compiler(text).output)
+    self.assertEqual(c.output, "")
+    
+    stream = io.BytesIO()
+    Compiler().compile_to(stream, text, compress=True)
+    self.assertEqual(stream.getvalue(), Compiler(text, compress=True).output.encode("utf-8"))
+    
+    # Text streams that are not io.TextIOBase are written text too
+    for mode in ['w+', 'w+b']:
+      with tempfile.SpooledTemporaryFile(mode=mode) as f:
+        Compiler().compile_to(f, text)
+        f.seek(0)
+        self.assertEqual(f.read(), Compiler(text).output if mode == 'w+' else Compiler(text).output.encode("utf-8"))
+    
+    stream = io.BytesIO()
+    Compiler().compile_to(codecs.getwriter("utf-16")(stream), text)
+    self.assertEqual(stream.getvalue().decode("utf-16"), Compiler(text).output)
+  
+  def test_compile_path(self):
+    text = u"`<!DOCTYPE html>\r\nul\r\n  li <h\u00e9\r\n    llo>\r\n  `<b>x</b>\n  p"
+    fd, filepath = tempfile.mkstemp(suffix=".wml")
+    try:
+      os.write(fd, text.encode("utf-8"))
+      os.close(fd)
+      self.assertEqual(Compiler().compile_path(filepath).output, Compiler(text).output)
+      
+      stream = io.BytesIO()
+      c = Compiler()
+      c.compile_path(filepath, stream, compress=True)
+      self.assertEqual(stream.getvalue(), Compiler(text, compress=True).output.encode("utf-8"))
+      self.assertEqual(c.output, "")
+      
+      with io.open(filepath, 'w') as f:
+        f.write(u"")
+      self.assertEqual(Compiler().compile_path(filepath).output, "")
+      
+      with io.open(filepath, 'w') as f:
+        f.write(u"div\n  p <unclosed\n")
+      self.assertRaises(CompilerException, Compiler().compile_path, filepath)
+    finally:
+      os.remove(filepath)
+  
+  def test_iter_compile(self):
+    text = "`<!DOCTYPE html>\nul\n  li \\-\\ a href=# <Home>\n  li <Lorem\n    ipsum>\n    \np <end>"
+    for compress in [False, True]:
+      expected = Compiler(text, compress=compress).output
+      self.assertEqual(''.join(iter_compile(io.StringIO(text), compress=compress)), expected)
+      chunks = [text[i:i+3] for i in range(0, len(text), 3)]
+      self.assertEqual(''.join(iter_compile(chunks, compress=compress)), expected)
+    
+    consumed = []
+    def lines():
+      for line in ["div\n", "  span <a>\n", "p\n"]:
+        consumed.append(line)
+        yield line
+    chunks = iter_compile(lines())
+    self.assertEqual(next(chunks), "<div>\n")
+    self.assertEqual(len(consumed), 1)
+    
+    with self.assertRaises(CompilerException):
+      list(iter_compile(["p <unclosed\n", "text\n"]))
+  
+  def test_include(self):
+    dir_path = tempfile.mkdtemp()
+    def write(name, text):
+      with io.open(os.path.join(dir_path, name), 'w') as f:
+        f.write(text)
+    source_path = os.path.join(dir_path, "page.wml")
+    
+    try:
+      write("_nav.wml", u"nav\n  ul\n    li <Home>\n    `<hr>\n")
+      text = "html\n  body\n    include _nav.wml\n    p <x>\n"
+      pasted = "html\n  body\n    nav\n      ul\n        li <Home>\n        `<hr>\n    p <x>\n"
+      for compress in [False, True]:
+        c = Compiler().compile(text, compress=compress, source_path=source_path)
+        self.assertEqual(c.output, Compiler(pasted, compress=compress).output)
+        self.assertEqual(render(Compiler().parse(text, source_path=source_path), compress=compress), c.output)
+      self.assertEqual(list(c.includes), [os.path.join(dir_path, "_nav.wml")])
+      
+      # The partial's indentation is used until the page has its own
+      text = "include _nav.wml\np\n  span"
+      pasted = "nav\n  ul\n    li <Home>\n    `<hr>\np\n  span"
+      self.assertEqual(Compiler().compile(text, source_path=source_path).output, Compiler(pasted).output)
+      self.assertEqual(render(Compiler().parse(text, source_path=source_path)), Compiler(pasted).output)
+      
+      # Partials are parsed once, until they change
+      document = partial_cache[os.path.join(dir_path, "_nav.wml")][1]
+      Compiler().compile(text, source_path=source_path)
+      self.assertIs(partial_cache[os.path.join(dir_path, "_nav.wml")][1], document)
+      write("_nav.wml", u"footer\n")
+      self.assertEqual(Compiler().compile(text, source_path=source_path).output, "<footer>\n</footer>\n<p>\n  <span>\n  </span>\n</p>\n")
+      
+      write("_a.wml", u"div\n  include _b.wml\n")
+      write("_b.wml", u"include _a.wml\n")
+      write("_bad.wml", u"p <unclosed\n")
+      for text in ["include _a.wml", "include _missing.wml", "include page.wml", "div\n  include _bad.wml"]:
+        self.assertRaises(CompilerException, Compiler().compile, text, source_path=source_path)
+      
+      # Compilers in many threads can fill and evict the shared cache at once
+      names = ["_p%d.wml" % i for i in range(64)]
+      for name in names:
+        write(name, u"span\n")
+      def compile_all():
+        for name in names:
+          Compiler().compile("include " + name, source_path=source_path)
+      cache_size = compile_module.partial_cache_size
+      compile_module.partial_cache_size = 4
+      Compiler.clear_caches()
+      try:
+        with ThreadPoolExecutor(8) as executor:
+          for future in [executor.submit(compile_all) for i in range(8)]:
+            future.result()
+      finally:
+        compile_module.partial_cache_size = cache_size
+      self.assertLessEqual(len(partial_cache), 4)
+    finally:
+      shutil.rmtree(dir_path)
+  
+  def test_minify(self):
+    def minify(text):
+      return Compiler(text, minify=True).output
+    
+    self.assertEqual(minify("ul\n  li <One>\n  li <Two   words>"), "<ul><li>One<li>Two words</ul>")
+    self.assertEqual(minify("a href=# title=a b data-x={{ v }} <x>"), '<a href=# title="a b" data-x="{{ v }}">x</a>')
+    self.assertEqual(minify("input#q value={{ q }} /\nbr /\nsvg\n  circle /"), '<input id=q value="{{ q }}"><br><svg><circle/></svg>')
+    self.assertEqual(minify("div\n  pre <a   b>\n  p <{{ a   b }}   c>"), "<div><pre>a   b</pre><p>{{ a   b }} c</div>")
+    self.assertEqual(minify("`<p>  a   <b>x</b>  </p>\n`<script>\n`  var  a;\n`</script>"), "<p> a <b>x</b> </p><script>  var  a;</script>")
+    
+    # p elements keep their end tags unless what follows closes them
+    self.assertEqual(minify("div\n  p <a>\n  div"), "<div><p>a<div></div></div>")
+    self.assertEqual(minify("div\n  p <a>\n  span <b>"), "<div><p>a</p><span>b</span></div>")
+    self.assertEqual(minify("div\n  p\n    div"), "<div><p><div></div></p></div>")
+    self.assertEqual(minify("a href=#\n  p <a>"), "<a href=#><p>a</p></a>")
+    self.assertEqual(minify("html\n  head\n    title <T>\n  body\n    p <x>"), "<html><head><title>T</title><body><p>x")
+    
+    # Without a parent, the context is unknown
+    self.assertEqual(minify("li <a>\nli <b>"), "<li>a</li><li>b</li>")
+    
+    # Raw text elements opened in inner text keep their content
+    self.assertEqual(minify("div <<pre>>\n  `a   b\n  `</pre>"), "<div><pre></div>a   b</pre>")
+    self.assertEqual(minify("div <<pre>a   b>"), "<div><pre>a   b</div>")
+    self.assertEqual(minify("div <<pre>>\np <x   y</pre>   z>"), "<div><pre></div><p>x   y</pre> z</p>")
+  
+  def test_compile_many(self):
+    texts = ["div\n  span <%d>" % i for i in range(20)]
+    texts[3] = "p <unclosed"
+    for compress in [False, True]:
+      for executor in [None, 'thread', 'process']:
+        results = compile_many(texts, compress=compress, executor=executor, workers=2)
+        self.assertEqual(len(results), len(texts))
+        self.assertIsInstance(results[3], CompilerException)
+        for i, text in enumerate(texts):
+          if i != 3:
+            self.assertEqual(results[i], Compiler(text, compress=compress).output)
+    
+    self.assertEqual(compile_many([]), [])
+    self.assertRaises(ValueError, compile_many, texts, executor='fiber')
+  
+  def test_lazy_exports(self):
+    # The package and the compile client load without the compiler
+    code = "import sys, wieldymarkup, wieldymarkup.client; print(sorted(m for m in sys.modules " \
+      "if m == 'multiprocessing' or m.startswith('wieldymarkup')))"
+    output = subprocess.check_output([sys.executable, "-c", code],
+      cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    self.assertEqual(output.decode('utf-8').strip(), "['wieldymarkup', 'wieldymarkup.client']")
+    
+    import wieldymarkup
+    self.assertIs(wieldymarkup.Compiler, Compiler)
+    self.assertIs(wieldymarkup.compile_sharded, compile_sharded)
+    self.assertRaises(AttributeError, getattr, wieldymarkup, 'compile_everything')
+  
+  def test_validate(self):
+    text = "div\n  p <a\n    b>\n   span <x>>\n  a href={{ x\n\tem\n   \n  p <unclosed\n  more\n"
+    c = Compiler()
+    errors = c.validate(text)
+    self.assertEqual([(e.line_number, str(e)) for e in errors], [
+      (4, "Inconsistent indentation found on line 4"),
+      (4, "Too many '>' found on line 4"),
+      (5, "Unmatched '{{' found in line 5"),
+      (6, "Inconsistent indentation found on line 6"),
+      (8, "Unmatched '<' found on line 8"),
+    ])
+    self.assertEqual(c.output, "")
+    self.assertEqual(c.validate("div\n  p <a\n    b>\n"), [])
+    
+    # Line numbers count the continuation lines of inner text
+    for engine in Compiler.engines:
+      with self.assertRaises(CompilerException) as context:
+        Compiler("p <a\n  b>\np <c\n", engine=engine)
+      self.assertEqual(str(context.exception), "Unmatched '<' found on line 3")
+      self.assertEqual(context.exception.line_number, 3)
+    
+    e = pickle.loads(pickle.dumps(errors[2]))
+    self.assertEqual((str(e), e.line_number), ("Unmatched '{{' found in line 5", 5))
+  
+  def test_engine(self):
+    with io.open(os.path.join(os.path.dirname(__file__), '..', '..', 'example', 'python-markup-test.wml'),
+        'r', encoding='utf-8') as f:
+      texts = [f.read()]
+    texts += [
+      "div\n\tp\n\t\tspan <a\n\t\t  b>\n`<hr>\n",
+      "ul \\-\\ li.x#y data-a={{ a }} \\-\\ a href=# <Home>\n  br /\n  \ninput /x",
+      "p <unclosed\n",
+      "p\n  span <a> b>\n",
+      "a href={{ x <y>\n",
+    ]
+    for text in texts:
+      for compress in [False, True]:
+        try:
+          expected = Compiler(text, compress=compress).output
+        except CompilerException as e:
+          with self.assertRaises(CompilerException) as context:
+            Compiler(text, compress=compress, engine='fast')
+          self.assertEqual(str(context.exception), str(e))
+        else:
+          self.assertEqual(Compiler(text, compress=compress, engine='fast').output, expected)
+    
+    self.assertRaises(ValueError, Compiler, "div", engine='turbo')
+  
+  def test_compile_sharded(self):
+    text = "div\n  p <a>\n\nul \\-\\ li <b\nc>\nspan\n  `<hr>\n  em <d\n\n  e>\n"
+    self.assertEqual(find_shard_starts(text, 1), [0, 12, 13, 26, 29, 50])
+    self.assertEqual(find_shard_starts(text, 100), [0])
+    for compress in [False, True]:
+      expected = Compiler(text, compress=compress).output
+      for size in [1, 5, 20, 100]:
+        self.assertEqual(compile_sharded(text, compress=compress, size=size, workers=1), expected)
+      self.assertEqual(compile_sharded(text * 20, compress=compress, size=40, workers=2),
+        Compiler(text * 20, compress=compress).output)
+    
+    # The indent token comes from the first shard that has one
+    self.assertEqual(compile_sharded("p\ndiv\n\tp\ndiv\n\t\tp <x>\n", size=1, workers=2),
+      Compiler("p\ndiv\n\tp\ndiv\n\t\tp <x>\n").output)
+    
+    # Errors are those of a serial compile, with the same line numbers
+    for bad_text in ["div\nspan <a\nb\n", text + "p <x>>\n" + text, text + "p <unclosed\n"]:
+      with self.assertRaises(CompilerException) as context:
+        Compiler(bad_text)
+      with self.assertRaises(CompilerException) as sharded_context:
+        compile_sharded(bad_text, size=1, workers=2)
+      self.assertEqual(str(sharded_context.exception), str(context.exception))
+      self.assertEqual(sharded_context.exception.line_number, context.exception.line_number)
+    
+    # Only a shard that ends inside its inner text goes on into the next
+    for engine in Compiler.engines:
+      self.assertRaises(UnterminatedTextException, Compiler, "p <a\n  b", engine=engine)
+      self.assertRaises(UnterminatedTextException, Compiler, "ul \\-\\ li <a\n", engine=engine)
+    self.assertEqual(compile_shard(("p <a\n", 0, False)), None)
+    self.assertIsInstance(compile_shard(("p <a\n", 0, True)), UnterminatedTextException)
+    error = compile_shard(("p <a>>\n", 0, False))
+    self.assertNotIsInstance(error, UnterminatedTextException)
+    self.assertEqual(str(error), "Too many '>' found on line 1")
+    error = pickle.loads(pickle.dumps(UnterminatedTextException("Unmatched '<' found on line 3", 3)))
+    self.assertIsInstance(error, UnterminatedTextException)
+    self.assertEqual(error.line_number, 3)
+  
+  def test_parse(self):
+    text = "`<!DOCTYPE html>\nul.nav\n  li.active \\-\\ a href=# <Home>\n  li\n    input#q value={{ q }} /\n"
+    document = Compiler().parse(text)
+    self.assertEqual(document, Document("  ", [
+      Embedded("<!DOCTYPE html>", 0),
+      Element("ul", classes=["nav"], level=0, children=[
+        Element("li", classes=["active"], level=1, children=[
+          Element("a", attributes=[("href", "#")], inner_text="Home", level=2),
+        ]),
+        Element("li", level=1, children=[
+          Element("input", id="q", attributes=[("value", "{{ q }}")], self_closing=True, level=2),
+        ]),
+      ]),
+    ], 2))
+    
+    self.assertEqual(render_pretty(document), Compiler(text).output)
+    self.assertEqual(render_compressed(document), Compiler(text, compress=True).output)
+    self.assertEqual(render(pickle.loads(pickle.dumps(document)), compress=True), Compiler(text, compress=True).output)
+    self.assertEqual(render(document, indent_token="\t"), Compiler(text.replace("  ", "\t")).output)
+    
+    # Tags emitted before the first indented line are not indented
+    text = "div \\-\\ span\n    p"
+    self.assertEqual(render(Compiler().parse(text)), Compiler(text).output)
+    
+    self.assertRaises(CompilerException, Compiler().parse, "p <unclosed")
+  
+  def test_get_cache_info(self):
+    Compiler.clear_caches()
+    Compiler("ul\n  li.item a=1 <One>\n  li.item a=1 <Two>\n  li.item a=1 <Three>\n")
+    cache_info = Compiler.get_cache_info()
+    self.assertEqual((cache_info['selectors'].hits, cache_info['selectors'].misses), (2, 2))
+    # Only the attributes are looked up, not the inner text after them
+    self.assertEqual((cache_info['attributes'].hits, cache_info['attributes'].misses), (2, 1))
+    
+    Compiler("ul\n  li.item a=1 <One>")
+    cache_info = Compiler.get_cache_info()
+    self.assertEqual((cache_info['selectors'].hits, cache_info['selectors'].misses), (4, 2))
+    self.assertEqual((cache_info['attributes'].hits, cache_info['attributes'].misses), (3, 1))
+    
+    Compiler.clear_caches()
+    for engine in Compiler.engines:
+      self.assertEqual(Compiler("a href=# <One>\na href=# <Two>\n", engine=engine).output,
+        '<a href="#">One</a>\n<a href="#">Two</a>\n')
+    cache_info = Compiler.get_cache_info()
+    self.assertEqual((cache_info['attributes'].hits, cache_info['attributes'].misses), (3, 1))
+    
+    # Inner text that could change how the attributes parse is kept in the key
+    Compiler.clear_caches()
+    self.assertEqual(Compiler("a href=# <x=y>\na href=# <x=z>\n", compress=True).output,
+      '<a href="#">x=y</a><a href="#">x=z</a>')
+    self.assertEqual(Compiler.get_cache_info()['attributes'].misses, 2)
+    
+    # Long attribute strings are not cached
+    Compiler.clear_caches()
+    Compiler("a title=" + "x" * 1000 + " <One>\n")
+    self.assertEqual(Compiler.get_cache_info()['attributes'].currsize, 0)
+    
+    # Errors are cached too, but still report the current line number
+    for i in range(2):
+      with self.assertRaises(CompilerException) as context:
+        Compiler("div\np a={{ b")
+      self.assertEqual(str(context.exception), "Unmatched '{{' found in line 2")
+  
+  def test_profile(self):
+    self.assertEqual(Compiler("div").stats, None)
+    
+    text = "ul\n  li.a x=1 <One>\n  li \\-\\ a href=# <Two\n    lines>\n  `<br />\n"
+    c = Compiler(text, profile=True)
+    self.assertEqual(c.output, Compiler(text).output)
+    self.assertEqual(c.stats.lines, 5)
+    self.assertEqual(c.stats.tags, 4)
+    self.assertEqual(c.stats.calls['process_selector'], 4)
+    self.assertEqual(c.stats.calls['process_attributes'], 4)
+    self.assertEqual(c.stats.bytes_in, len(text))
+    self.assertEqual(c.stats.bytes_out, len(c.output))
+    self.assertTrue(all(t >= 0 for t in c.stats.times.values()))
+    
+    c = Compiler(profile=True).compile(text + "p <\u00e9>\n", minify=True)
+    self.assertEqual(c.output, Compiler(text + "p <\u00e9>\n", minify=True).output)
+    self.assertEqual(c.stats.tags, 5)
+    self.assertEqual(c.stats.bytes_out, len(c.output.encode('utf-8')))
+  
 
 
 
@@ -0,0 +1,62 @@
+import os, json, random, tempfile
+import six
+
+if six.PY3:
+  import unittest
+else:
+  import unittest2 as unittest
+
+from wieldymarkup.compile import Compiler
+from wieldymarkup.benchmark import cases, generate_document, compare_to_baseline, get_baseline_result, \
+  baseline_path, main
+from wieldymarkup.differential import generate_random_document, compare_engines, run_engine
+
+class TestBenchmark(unittest.TestCase):
+  
+  def test_generate_document(self):
+    for name, kwargs in cases:
+      kwargs = dict(kwargs, size=2048)
+      text = generate_document(**kwargs)
+      self.assertTrue(len(text) >= 2048, name)
+      self.assertEqual(text, generate_document(**kwargs))
+      Compiler(text)
+  
+  def test_compare_to_baseline(self):
+    baseline = {'a': {'megabytes': 1.0, 'pretty_relative_speed': 1.0, 'pretty_peak_kb': 100.0}}
+    results = {'a': {'megabytes': 2.0, 'pretty_mb_per_s': 4.0, 'pretty_relative_speed': 0.8,
+      'pretty_peak_kb': 120.0}, 'b': {}}
+    self.assertEqual(compare_to_baseline(results, baseline), [])
+    
+    results['a']['pretty_relative_speed'] = 0.7
+    results['a']['pretty_peak_kb'] = 130.0
+    self.assertEqual(compare_to_baseline(results, baseline), [
+      "a pretty_peak_kb: 100.0 -> 130.0",
+      "a pretty_relative_speed: 1.0 -> 0.7",
+    ])
+    
+    # Throughput in MB/s depends on the machine, so it is not compared
+    self.assertEqual(get_baseline_result(results['a']),
+      {'megabytes': 2.0, 'pretty_relative_speed': 0.7, 'pretty_peak_kb': 130.0})
+  
+  def test_baseline(self):
+    with open(baseline_path) as f:
+      baseline = json.load(f)
+    self.assertEqual(sorted(baseline), sorted(name for name, kwargs in cases))
+    for name in baseline:
+      self.assertEqual(sorted(baseline[name]), ['compressed_peak_kb', 'compressed_relative_speed',
+        'megabytes', 'pretty_peak_kb', 'pretty_relative_speed'])
+    
+    # Without a baseline to compare with, nothing runs unless it is saved
+    stream = six.StringIO()
+    missing_path = os.path.join(tempfile.gettempdir(), "wieldymarkup-missing-baseline.json")
+    self.assertEqual(main(["--baseline", missing_path], stream=stream, error_stream=stream), 1)
+    self.assertEqual(stream.getvalue(), "No baseline at " + missing_path + "; run with --save to record one.\n")
+  
+  def test_compare_engines(self):
+    rng = random.Random(0)
+    texts = [generate_random_document(rng, invalid_ratio=0.1) for i in range(300)]
+    self.assertEqual(texts[0], generate_random_document(random.Random(0), invalid_ratio=0.1))
+    results = [run_engine('reference', text)[0] for text in texts]
+    self.assertIn('output', results)
+    self.assertIn('error', results)
+    self.assertEqual(compare_engines(texts), [])
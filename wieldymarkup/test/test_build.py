@@ -0,0 +1,408 @@
+import io, os, gzip, json, shutil, tempfile, asyncio, threading
+from concurrent.futures import ProcessPoolExecutor
+import six
+
+if six.PY3:
+  import unittest
+else:
+  import unittest2 as unittest
+
+from wieldymarkup.compile import Compiler
+from wieldymarkup import build
+from wieldymarkup.build import find_source_files, build_files, check_files, write_profile
+from wieldymarkup.cache import BuildCache
+from wieldymarkup.watch import Watcher
+from wieldymarkup.aio import compile_file, compile_tree
+from wieldymarkup.server import CompileServer
+from wieldymarkup.client import Client
+from wieldymarkup.__main__ import main
+
+class TestBuild(unittest.TestCase):
+  
+  def setUp(self):
+    self.dir_path = tempfile.mkdtemp()
+  
+  def tearDown(self):
+    shutil.rmtree(self.dir_path)
+  
+  def write(self, name, text):
+    filepath = os.path.join(self.dir_path, name)
+    if not os.path.isdir(os.path.dirname(filepath)):
+      os.makedirs(os.path.dirname(filepath))
+    with io.open(filepath, 'w', encoding='utf-8') as f:
+      f.write(text)
+    return filepath
+  
+  def read(self, name):
+    with io.open(os.path.join(self.dir_path, name), encoding='utf-8') as f:
+      return f.read()
+  
+  def test_find_source_files(self):
+    self.write("b.wml", "div")
+    self.write("a.wml", "div")
+    self.write("notes.txt", "div")
+    self.write("sub/c.wml", "div")
+    
+    self.assertEqual(find_source_files(self.dir_path), [
+      os.path.join(self.dir_path, "a.wml"),
+      os.path.join(self.dir_path, "b.wml"),
+    ])
+    self.assertEqual(find_source_files(self.dir_path, recursive=True), [
+      os.path.join(self.dir_path, "a.wml"),
+      os.path.join(self.dir_path, "b.wml"),
+      os.path.join(self.dir_path, "sub", "c.wml"),
+    ])
+  
+  def test_build_files(self):
+    text = "ul\n  li \\-\\ a href=# <Home>\n"
+    filepaths = [
+      self.write("a.wml", text),
+      self.write("bad.wml", "p <unclosed\n"),
+      self.write("sub/c.wml", text),
+    ]
+    
+    results = build_files(filepaths, compress=True, jobs=2)
+    self.assertEqual([result.source for result in results], filepaths)
+    self.assertEqual([result.error for result in results], [None, "Unmatched '<' found on line 1", None])
+    self.assertEqual(self.read("a.html"), Compiler(text, compress=True).output)
+    self.assertEqual(self.read("sub/c.html"), Compiler(text, compress=True).output)
+    self.assertFalse(os.path.exists(os.path.join(self.dir_path, "bad.html")))
+    self.assertEqual([result.stats for result in results], [None, None, None])
+    
+    # Large sources are compiled from a memory mapping
+    mmap_threshold = build.mmap_threshold
+    build.mmap_threshold = 0
+    try:
+      results = build_files(filepaths, jobs=1)
+    finally:
+      build.mmap_threshold = mmap_threshold
+    self.assertEqual([result.error for result in results], [None, "Unmatched '<' found on line 1", None])
+    self.assertEqual(self.read("a.html"), Compiler(text).output)
+    self.assertFalse(os.path.exists(os.path.join(self.dir_path, "bad.html")))
+  
+  def test_profile(self):
+    filepaths = [self.write("a.wml", "ul\n  li <One>\n  li <Two>\n"), self.write("b.wml", "p <unclosed\n")]
+    results = build_files(filepaths, jobs=2, profile=True)
+    self.assertEqual(results[0].stats.lines, 3)
+    self.assertEqual(results[0].stats.tags, 3)
+    self.assertEqual(results[1].stats, None)
+    
+    stream = six.StringIO()
+    write_profile(results, stream)
+    rows = stream.getvalue().splitlines()
+    self.assertEqual(len(rows), 3)
+    self.assertTrue(rows[0].startswith("file"))
+    self.assertTrue(rows[1].startswith(filepaths[0]))
+    self.assertTrue(rows[2].startswith("TOTAL"))
+    
+    results = build_files(filepaths[:1], jobs=1, profile=True, minify=True)
+    self.assertEqual(results[0].stats.bytes_out, len("<ul><li>One<li>Two</ul>"))
+  
+  def test_write_if_changed(self):
+    filepath = self.write("a.wml", "div <one>")
+    output = os.path.join(self.dir_path, "a.html")
+    build_files([filepath], jobs=1)
+    os.utime(output, (0, 0))
+    
+    # Unchanged output is not rewritten, by either compile path
+    build_files([filepath], jobs=1)
+    self.assertEqual(os.stat(output).st_mtime, 0)
+    mmap_threshold = build.mmap_threshold
+    build.mmap_threshold = 0
+    try:
+      build_files([filepath], jobs=1)
+      self.assertEqual(os.stat(output).st_mtime, 0)
+      self.write("a.wml", "div <two>")
+      build_files([filepath], jobs=1)
+      self.assertEqual(self.read("a.html"), "<div>two</div>\n")
+    finally:
+      build.mmap_threshold = mmap_threshold
+    
+    self.write("a.wml", "div <three>")
+    build_files([filepath], jobs=1)
+    self.assertEqual(self.read("a.html"), "<div>three</div>\n")
+    
+    # A failed compile leaves the last output in place
+    self.write("a.wml", "div <unclosed")
+    self.assertNotEqual(build_files([filepath], jobs=1)[0].error, None)
+    self.assertEqual(self.read("a.html"), "<div>three</div>\n")
+    self.assertEqual(sorted(os.listdir(self.dir_path)), ["a.html", "a.wml"])
+  
+  def test_precompress(self):
+    filepath = self.write("a.wml", "div <one>")
+    output = os.path.join(self.dir_path, "a.html")
+    precompress_threshold = build.precompress_threshold
+    build.precompress_threshold = 20
+    try:
+      # Outputs below the threshold are not compressed
+      build_files([filepath], jobs=1, precompress=True)
+      self.assertFalse(os.path.exists(output + ".gz"))
+      
+      self.write("a.wml", "div <one two three>")
+      build_files([filepath], jobs=1, precompress=True)
+      with gzip.open(output + ".gz", 'rb') as f:
+        self.assertEqual(f.read().decode('utf-8'), self.read("a.html"))
+      # No timestamp, so the same output always compresses the same
+      with open(output + ".gz", 'rb') as f:
+        self.assertEqual(f.read()[4:8], b"\0\0\0\0")
+      
+      # Unchanged output keeps its compressed copies, by either compile path
+      os.utime(output + ".gz", (0, 0))
+      os.utime(output, (0, 0))
+      build_files([filepath], jobs=1, precompress=True)
+      self.assertEqual(os.stat(output + ".gz").st_mtime, 0)
+      mmap_threshold = build.mmap_threshold
+      build.mmap_threshold = 0
+      try:
+        build_files([filepath], jobs=1, precompress=True)
+        self.assertEqual(os.stat(output + ".gz").st_mtime, 0)
+        self.write("a.wml", "div <four five six>")
+        build_files([filepath], jobs=1, precompress=True)
+        with gzip.open(output + ".gz", 'rb') as f:
+          self.assertEqual(f.read(), b"<div>four five six</div>\n")
+      finally:
+        build.mmap_threshold = mmap_threshold
+      
+      # A cached build is redone when a compressed copy has gone missing
+      cache = BuildCache(os.path.join(self.dir_path, "cache.json"))
+      self.assertFalse(build_files([filepath], jobs=1, cache=cache, precompress=True)[0].cached)
+      self.assertTrue(build_files([filepath], jobs=1, cache=cache, precompress=True)[0].cached)
+      os.remove(output + ".gz")
+      self.assertFalse(build_files([filepath], jobs=1, cache=cache, precompress=True)[0].cached)
+      self.assertTrue(os.path.exists(output + ".gz"))
+      
+      # Shrinking below the threshold removes stale copies
+      self.write("a.wml", "div <one>")
+      build_files([filepath], jobs=1, precompress=True)
+      self.assertFalse(os.path.exists(output + ".gz"))
+    finally:
+      build.precompress_threshold = precompress_threshold
+  
+  def test_compile_tree(self):
+    text = "ul\n  li \\-\\ a href=# <Home>\n"
+    self.write("a.wml", text)
+    self.write("bad.wml", "p <unclosed\n")
+    self.write("sub/c.wml", text)
+    
+    self.assertEqual(asyncio.run(compile_file(os.path.join(self.dir_path, "a.wml"), compress=True)),
+      os.path.join(self.dir_path, "a.html"))
+    self.assertEqual(self.read("a.html"), Compiler(text, compress=True).output)
+    with self.assertRaises(Exception):
+      asyncio.run(compile_file(os.path.join(self.dir_path, "bad.wml")))
+    self.assertFalse(os.path.exists(os.path.join(self.dir_path, "bad.html")))
+    
+    completed = []
+    with ProcessPoolExecutor(2) as executor:
+      results = asyncio.run(compile_tree(self.dir_path, recursive=True, executor=executor, limit=2,
+        callback=completed.append))
+    self.assertEqual([os.path.relpath(result.source, self.dir_path) for result in results],
+      ["a.wml", "bad.wml", os.path.join("sub", "c.wml")])
+    self.assertEqual([result.error for result in results], [None, "Unmatched '<' found on line 1", None])
+    self.assertEqual(sorted(completed, key=lambda result: result.source), results)
+    self.assertEqual(self.read("sub/c.html"), Compiler(text).output)
+  
+  def test_build_cache(self):
+    cache_path = os.path.join(self.dir_path, "cache.json")
+    filepaths = [self.write("a.wml", "div"), self.write("b.wml", "span")]
+    
+    def build(compress=False):
+      cache = BuildCache(cache_path).load()
+      results = build_files(filepaths, compress=compress, jobs=1, cache=cache)
+      cache.save()
+      return [result.cached for result in results]
+    
+    self.assertEqual(build(), [False, False])
+    self.assertEqual(build(), [True, True])
+    
+    # Same content with a new mtime is still fresh
+    os.utime(filepaths[0], (0, 0))
+    self.assertEqual(build(), [True, True])
+    
+    self.write("a.wml", "p")
+    self.assertEqual(build(), [False, True])
+    self.assertEqual(self.read("a.html"), "<p>\n</p>\n")
+    
+    os.remove(os.path.join(self.dir_path, "b.html"))
+    self.assertEqual(build(), [True, False])
+    self.assertEqual(build(compress=True), [False, False])
+  
+  def test_include_dependencies(self):
+    cache_path = os.path.join(self.dir_path, "cache.json")
+    self.write("_nav.wml", "nav")
+    filepaths = [self.write("a.wml", "div\n  include _nav.wml"), self.write("b.wml", "span")]
+    
+    def build():
+      cache = BuildCache(cache_path).load()
+      results = build_files(filepaths, jobs=1, cache=cache)
+      cache.save()
+      return [result.cached for result in results]
+    
+    self.assertEqual(build(), [False, False])
+    self.assertEqual(build(), [True, True])
+    self.assertEqual(BuildCache(cache_path).load().get_dependents(os.path.join(self.dir_path, "_nav.wml")),
+      [os.path.abspath(filepaths[0])])
+    
+    # Editing the partial only rebuilds the page that includes it
+    self.write("_nav.wml", "footer")
+    self.assertEqual(build(), [False, True])
+    self.assertEqual(self.read("a.html"), "<div>\n  <footer>\n  </footer>\n</div>\n")
+    
+    cache = BuildCache(cache_path).load()
+    stream = six.StringIO()
+    watcher = Watcher(self.dir_path, cache=cache, debounce=0, stream=stream, error_stream=stream)
+    self.write("_nav.wml", "header")
+    results = watcher.poll()
+    self.assertEqual([os.path.basename(result.source) for result in results], ["_nav.wml", "a.wml"])
+    self.assertEqual(self.read("a.html"), "<div>\n  <header>\n  </header>\n</div>\n")
+  
+  def test_include_edited_during_build(self):
+    self.write("_nav.wml", "nav")
+    filepath = self.write("a.wml", "include _nav.wml")
+    result = build.build_file(filepath, signature=True)
+    nav_path = os.path.join(self.dir_path, "_nav.wml")
+    self.assertEqual(list(result.includes), [nav_path])
+    
+    # An edit after the partial was parsed is not recorded as built
+    self.write("_nav.wml", "footer")
+    cache = BuildCache(os.path.join(self.dir_path, "cache.json"))
+    cache.update(result.source, result.output, {'compress': False}, result.signature, result.includes)
+    self.assertFalse(cache.is_fresh(filepath, {'compress': False}))
+  
+  def test_watcher(self):
+    self.write("a.wml", "div")
+    self.write("b.wml", "div")
+    stream = six.StringIO()
+    watcher = Watcher(self.dir_path, recursive=True, debounce=0, stream=stream, error_stream=stream)
+    self.assertEqual(watcher.poll(), None)
+    
+    self.write("a.wml", "span <changed>")
+    self.write("sub/c.wml", "p <unclosed")
+    os.remove(os.path.join(self.dir_path, "b.wml"))
+    results = watcher.poll()
+    self.assertEqual([os.path.basename(result.source) for result in results], ["a.wml", "c.wml"])
+    self.assertEqual(self.read("a.html"), "<span>changed</span>\n")
+    self.assertIn("Kept the output of deleted " + os.path.join(self.dir_path, "b.wml"), stream.getvalue())
+    self.assertIn("Rebuilt 2 files in", stream.getvalue())
+    self.assertIn("(1 failed)", stream.getvalue())
+    self.assertEqual(watcher.poll(), None)
+    
+    # Outputs the cache recorded are removed with their source
+    precompress_threshold = build.precompress_threshold
+    build.precompress_threshold = 0
+    try:
+      stream = six.StringIO()
+      watcher = Watcher(self.dir_path, cache=BuildCache(os.path.join(self.dir_path, "cache.json")),
+        debounce=0, stream=stream, error_stream=stream, precompress=True)
+      self.write("a.wml", "span <again>")
+      watcher.poll()
+      self.assertTrue(os.path.exists(os.path.join(self.dir_path, "a.html.gz")))
+      os.remove(os.path.join(self.dir_path, "a.wml"))
+      watcher.poll()
+    finally:
+      build.precompress_threshold = precompress_threshold
+    self.assertFalse(os.path.exists(os.path.join(self.dir_path, "a.html")))
+    self.assertFalse(os.path.exists(os.path.join(self.dir_path, "a.html.gz")))
+    self.assertIn("Removed " + os.path.join(self.dir_path, "a.html") + ", the output of deleted " +
+      os.path.join(self.dir_path, "a.wml"), stream.getvalue())
+  
+  def test_check_files(self):
+    good = self.write("good.wml", "div\n  p <one>\n")
+    bad = self.write("bad.wml", "div\n  p <one>>\n  a href={{ x\n")
+    results = check_files([good, bad, os.path.join(self.dir_path, "missing.wml")], jobs=2)
+    self.assertEqual(results[0].errors, ())
+    self.assertEqual(results[1].errors, ("Too many '>' found on line 2", "Unmatched '{{' found in line 3"))
+    self.assertEqual(results[1].error, results[1].errors[0])
+    self.assertEqual(len(results[2].errors), 1)
+    self.assertEqual(sorted(os.listdir(self.dir_path)), ["bad.wml", "good.wml"])
+    
+    self.assertEqual(main(["--check", good]), 0)
+    self.assertEqual(main(["--check", "-d", self.dir_path]), 1)
+    self.assertEqual(sorted(os.listdir(self.dir_path)), ["bad.wml", "good.wml"])
+  
+  def test_report(self):
+    a = self.write("a.wml", "div <one>")
+    bad = self.write("bad.wml", "div\n  p <one>>\n")
+    other = self.write("other.txt", "div")
+    report_path = os.path.join(self.dir_path, "build.json")
+    self.assertEqual(main(["-f", "--cache-file", os.path.join(self.dir_path, "cache.json"),
+      "--report", report_path, "--report-slowest", "1", a, bad, other]), 1)
+    with io.open(report_path, 'r', encoding='utf-8') as f:
+      report = json.load(f)
+    
+    self.assertEqual([(record['status'], record['error'], record['line_number']) for record in report['files']], [
+      ('compiled', None, None),
+      ('failed', "Too many '>' found on line 2", 2),
+      ('skipped', None, None),
+    ])
+    self.assertEqual(report['files'][0]['source'], a)
+    self.assertEqual(report['files'][0]['output'], os.path.join(self.dir_path, "a.html"))
+    self.assertEqual(report['files'][0]['bytes_in'], 9)
+    self.assertEqual(report['files'][0]['bytes_out'], len("<div>one</div>\n"))
+    self.assertEqual(report['files'][1]['output'], None)
+    self.assertEqual(report['totals']['files'], 3)
+    self.assertEqual(report['totals']['failed'], 1)
+    self.assertEqual(report['totals']['bytes_in'], 9 + len("div\n  p <one>>\n") + 3)
+    self.assertEqual([record['source'] for record in report['slowest']], [a])
+    
+    main(["--cache-file", os.path.join(self.dir_path, "cache.json"), "--report", report_path, a])
+    with io.open(report_path, 'r', encoding='utf-8') as f:
+      report = json.load(f)
+    self.assertEqual(report['files'][0]['status'], 'cached')
+    self.assertEqual(report['totals']['cached'], 1)
+    self.assertEqual(report['slowest'], [])
+  
+  def test_server(self):
+    socket_path = os.path.join(self.dir_path, "server.sock")
+    server = CompileServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+      filepath = self.write("a.wml", "div <one>")
+      self.write("bad.wml", "p <unclosed\n")
+      with Client(socket_path, timeout=10) as client:
+        self.assertEqual(client.request(text="div <one>", compress=True), {'html': "<div>one</div>"})
+        self.assertEqual(client.request(path=filepath), {'output': os.path.join(self.dir_path, "a.html")})
+        self.assertEqual(self.read("a.html"), "<div>one</div>\n")
+        self.assertEqual(client.request(path=filepath, write=False, minify=True), {'html': "<div>one</div>"})
+        self.assertIn('error', client.request(path=os.path.join(self.dir_path, "bad.wml")))
+        self.assertIn('error', client.request(source="div"))
+        # Only .wml files are compiled, whether or not they are written
+        other = self.write("notes.txt", "div")
+        for write in [True, False]:
+          self.assertEqual(client.request(path=other, write=write),
+            {'error': "Invalid extension (" + other + "). Must be .wml."})
+        self.assertEqual(client.request(path=other, write=False, strict=False), {'html': None})
+        self.assertEqual(client.request(path=other, strict=False), {'output': None})
+        # The connection survives errors
+        self.assertEqual(client.request(text="br /"), {'html': "<br />\n"})
+      
+      self.write("a.wml", "div <two>")
+      self.assertEqual(main(["client", "--socket", socket_path, "-c", filepath]), 0)
+      self.assertEqual(self.read("a.html"), "<div>two</div>")
+      self.assertEqual(main(["client", "--socket", socket_path, os.path.join(self.dir_path, "bad.wml")]), 1)
+      
+      with self.assertRaises(Exception):
+        CompileServer(socket_path)
+    finally:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+    self.assertFalse(os.path.exists(socket_path))
+  
+  def test_main(self):
+    self.write("a.wml", "div")
+    self.write("sub/b.wml", "div")
+    self.assertEqual(main(["-d", self.dir_path, "-r", "-j", "2"]), 0)
+    self.assertEqual(self.read("sub/b.html"), "<div>\n</div>\n")
+    
+    self.write("sub/bad.wml", "p <unclosed\n")
+    self.assertEqual(main(["-d", self.dir_path, "-r", "-j", "1"]), 1)
+    
+    with io.open(os.path.join(self.dir_path, "sub", "b.html"), 'w') as f:
+      f.write(u"stale")
+    main(["-d", self.dir_path, "-r", "-j", "1"])
+    self.assertEqual(self.read("sub/b.html"), "stale")
+    main(["-d", self.dir_path, "-r", "-j", "1", "--no-cache"])
+    self.assertEqual(self.read("sub/b.html"), "<div>\n</div>\n")
+    main(["-d", self.dir_path, "-r", "-j", "1", "--minify"])
+    self.assertEqual(self.read("sub/b.html"), "<div></div>")
@@ -0,0 +1,156 @@
+"""
+A compact document tree produced by Compiler.parse, and renderers that
+turn it into pretty or compressed HTML without parsing the source again.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+class Node(object):
+  """
+  Base class for tree nodes. Nodes only have __slots__, and pickle as a
+  tuple of their slot values.
+  """
+  
+  __slots__ = ()
+  
+  def __getstate__(self):
+    return tuple(getattr(self, name) for name in self.__slots__)
+  
+  def __setstate__(self, state):
+    for name, value in zip(self.__slots__, state):
+      setattr(self, name, value)
+  
+  def __eq__(self, other):
+    return type(self) is type(other) and self.__getstate__() == other.__getstate__()
+  
+  def __ne__(self, other):
+    return not self == other
+  
+  __hash__ = None
+
+class Document(Node):
+  """
+  The root of a parsed document. indent_token is the indentation detected
+  in the source, and children the top-level nodes. The compiler emits tags
+  without indentation until it has seen the first indented line, so the
+  first unindented_count tags (opening and closing, in output order) are
+  rendered without indentation too.
+  """
+  
+  __slots__ = ('indent_token', 'children', 'unindented_count')
+  
+  def __init__(self, indent_token="", children=None, unindented_count=0):
+    self.indent_token = indent_token
+    self.children = [] if children is None else children
+    self.unindented_count = unindented_count
+
+class Element(Node):
+  """
+  An HTML tag. attributes is a list of (name, value) pairs in source order.
+  Elements with inner_text or self_closing set have no children. level is
+  the indentation level of the line that opened the element.
+  """
+  
+  __slots__ = ('tag', 'id', 'classes', 'attributes', 'inner_text', 'self_closing', 'level', 'children')
+  
+  def __init__(self, tag, id=None, classes=None, attributes=None, inner_text=None,
+      self_closing=False, level=0, children=None):
+    self.tag = tag
+    self.id = id
+    self.classes = [] if classes is None else classes
+    self.attributes = [] if attributes is None else attributes
+    self.inner_text = inner_text
+    self.self_closing = self_closing
+    self.level = level
+    self.children = [] if children is None else children
+
+class Embedded(Node):
+  """
+  A line of HTML embedded with the back tick, copied to the output as is.
+  """
+  
+  __slots__ = ('html', 'level')
+  
+  def __init__(self, html, level=0):
+    self.html = html
+    self.level = level
+
+def render(document, compress=False, indent_token=None):
+  """
+  Returns the HTML for document. indent_token overrides the indentation
+  detected in the source when rendering pretty output.
+  """
+  if compress:
+    return render_compressed(document)
+  return render_pretty(document, indent_token)
+
+def render_pretty(document, indent_token=None):
+  if indent_token is None:
+    indent_token = document.indent_token
+  fragments = []
+  write_nodes(fragments, document.children, indent_token, "\n", document.unindented_count)
+  return ''.join(fragments)
+
+def render_compressed(document):
+  fragments = []
+  write_nodes(fragments, document.children, "", "")
+  return ''.join(fragments)
+
+def get_start_tag(element):
+  parts = ["<", element.tag]
+  if element.id is not None:
+    parts.append(' id="' + element.id + '"')
+  if len(element.classes) > 0:
+    parts.append(' class="' + ' '.join(element.classes) + '"')
+  for name, value in element.attributes:
+    parts.append(' ' + name + '="' + value + '"')
+  parts.append(' />' if element.self_closing else '>')
+  return ''.join(parts)
+
+def copy_nodes(nodes, level_offset=0):
+  """
+  Returns copies of nodes and all of their descendants, with level_offset
+  added to their levels.
+  """
+  copies = []
+  stack = [(nodes, copies)]
+  while stack:
+    nodes, target = stack.pop()
+    for node in nodes:
+      if isinstance(node, Embedded):
+        target.append(Embedded(node.html, node.level + level_offset))
+      else:
+        element = Element(node.tag, node.id, list(node.classes), list(node.attributes), node.inner_text,
+          node.self_closing, node.level + level_offset)
+        target.append(element)
+        stack.append((node.children, element.children))
+  return copies
+
+def write_nodes(fragments, nodes, indent_token, line_break, unindented_count=0, level_offset=0):
+  # Walk the tree with an explicit stack so deep nesting cannot hit the
+  # recursion limit. Closing tags are pushed as (level, tag) tuples.
+  # Each node adds one fragment, in the order the compiler emits them.
+  final_indent_token = indent_token
+  indent_token = ""
+  stack = [iter(nodes)]
+  while stack:
+    if len(fragments) == unindented_count:
+      indent_token = final_indent_token
+    node = next(stack[-1], None)
+    if node is None:
+      stack.pop()
+    elif isinstance(node, tuple):
+      fragments.append(node[0] * indent_token + "</" + node[1] + ">" + line_break)
+    else:
+      level = node.level + level_offset
+      if isinstance(node, Embedded):
+        fragments.append(level * indent_token + node.html + line_break)
+      elif node.self_closing:
+        fragments.append(level * indent_token + get_start_tag(node) + line_break)
+      elif node.inner_text is not None:
+        fragments.append(level * indent_token + get_start_tag(node) + node.inner_text + "</" + node.tag + ">" + line_break)
+      else:
+        fragments.append(level * indent_token + get_start_tag(node) + line_break)
+        stack.append(iter([(level, node.tag)]))
+        stack.append(iter(node.children))
@@ -0,0 +1,166 @@
+"""
+Keeps a process resident that recompiles .wml files as they change, for
+the command line interface's --watch mode.
+
+:copyright: (c) 2013 by Vail Gold.
+:license: See LICENSE.txt for details.
+"""
+
+import os, sys, time
+
+from wieldymarkup.build import find_source_files, build_files, write_errors, remove_output
+
+try:
+  import inotify_simple
+except ImportError:
+  inotify_simple = None
+
+def take_snapshot(dir_path, recursive=False):
+  """
+  Returns {filepath: (mtime_ns, size)} for the .wml files in dir_path.
+  """
+  snapshot = {}
+  for filepath in find_source_files(dir_path, recursive=recursive):
+    try:
+      stat = os.stat(filepath)
+    except OSError:
+      continue
+    snapshot[filepath] = (stat.st_mtime_ns, stat.st_size)
+  return snapshot
+
+def compare_snapshots(old, new):
+  """
+  Returns the sorted (created, modified, deleted) filepaths between two
+  snapshots.
+  """
+  created = sorted(filepath for filepath in new if filepath not in old)
+  modified = sorted(filepath for filepath in new if filepath in old and new[filepath] != old[filepath])
+  deleted = sorted(filepath for filepath in old if filepath not in new)
+  return created, modified, deleted
+
+class Watcher(object):
+  """
+  Polls dir_path every interval seconds and recompiles the .wml files that
+  were created or modified, in this process, along with the files that
+  include them according to the dependency index of cache. When a file is
+  deleted, the output cache recorded for it is deleted too. Changes are
+  collected until the directory has been still for debounce seconds, so a
+  burst of saves leads to one rebuild. Where the inotify_simple module is
+  installed, the wait between polls ends as soon as the kernel reports a
+  change.
+  """
+  
+  def __init__(self, dir_path, recursive=False, compress=False, cache=None,
+      interval=0.5, debounce=0.1, stream=sys.stdout, error_stream=sys.stderr, minify=False,
+      precompress=False):
+    self.dir_path = dir_path
+    self.recursive = recursive
+    self.compress = compress
+    self.minify = minify
+    self.precompress = precompress
+    self.cache = cache
+    self.interval = interval
+    self.debounce = debounce
+    self.stream = stream
+    self.error_stream = error_stream
+    self.snapshot = take_snapshot(dir_path, recursive)
+    self.inotify = None
+    if inotify_simple is not None:
+      self.watch_directories()
+  
+  def watch_directories(self):
+    flags = inotify_simple.flags
+    mask = flags.CREATE | flags.MODIFY | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE
+    if self.inotify is not None:
+      self.inotify.close()
+    self.inotify = inotify_simple.INotify()
+    if self.recursive:
+      for root, dirs, files in os.walk(self.dir_path):
+        self.inotify.add_watch(root, mask)
+    else:
+      self.inotify.add_watch(self.dir_path, mask)
+  
+  def wait(self, seconds):
+    if self.inotify is None:
+      time.sleep(seconds)
+    else:
+      self.inotify.read(timeout=int(seconds * 1000))
+  
+  def poll(self):
+    """
+    Rebuilds whatever changed since the last poll and returns the
+    BuildResults, or returns None if nothing changed.
+    """
+    snapshot = take_snapshot(self.dir_path, self.recursive)
+    if snapshot == self.snapshot:
+      return None
+    
+    # Wait for the burst of changes to settle
+    while self.debounce > 0:
+      time.sleep(self.debounce)
+      latest = take_snapshot(self.dir_path, self.recursive)
+      if latest == snapshot:
+        break
+      snapshot = latest
+    
+    created, modified, deleted = compare_snapshots(self.snapshot, snapshot)
+    self.snapshot = snapshot
+    if self.inotify is not None and self.recursive:
+      # Pick up new subdirectories
+      self.watch_directories()
+    
+    filepaths = set(created + modified)
+    if self.cache is not None:
+      # Rebuild the files that include a changed partial, too
+      snapshot_paths = dict((os.path.abspath(filepath), filepath) for filepath in snapshot)
+      for filepath in created + modified + deleted:
+        for dependent in self.cache.get_dependents(filepath):
+          if dependent in snapshot_paths:
+            filepaths.add(snapshot_paths[dependent])
+    return self.rebuild(sorted(filepaths), deleted)
+  
+  def rebuild(self, filepaths, deleted=()):
+    start = time.time()
+    results = build_files(filepaths, compress=self.compress, jobs=1, cache=self.cache, minify=self.minify,
+      precompress=self.precompress)
+    for filepath in deleted:
+      output = None
+      if self.cache is not None:
+        output = self.cache.get_output(filepath)
+        self.cache.discard(filepath)
+      # Without a cache entry, an .html file next to the source may not be
+      # one the build wrote
+      if output is None:
+        self.stream.write("Kept the output of deleted " + filepath + "\n")
+      else:
+        remove_output(output)
+        self.stream.write("Removed " + output + ", the output of deleted " + filepath + "\n")
+    if self.cache is not None:
+      self.cache.save()
+    elapsed = time.time() - start
+    
+    failed = write_errors(results, self.error_stream)
+    self.stream.write("Rebuilt %d file%s in %.1f ms%s\n" % (
+      len(results),
+      "" if len(results) == 1 else "s",
+      elapsed * 1000,
+      " (%d failed)" % failed if failed else "",
+    ))
+    self.stream.flush()
+    return results
+  
+  def run(self):
+    """
+    Polls until interrupted with Ctrl-C.
+    """
+    self.stream.write("Watching " + self.dir_path + " for changes. Press Ctrl-C to stop.\n")
+    self.stream.flush()
+    try:
+      while True:
+        self.wait(self.interval)
+        self.poll()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      if self.inotify is not None:
+        self.inotify.close()